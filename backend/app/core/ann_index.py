@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+
+_AUTO_PROBE_FRACTION = 0.3
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, *, batch: int = 8192) -> np.ndarray:
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for i in range(0, x.shape[0], batch):
+        out[i : i + batch] = np.argmax(x[i : i + batch] @ centroids.T, axis=1)
+    return out
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(x, axis=1, keepdims=True)
+    n[n == 0.0] = 1.0
+    return (x / n).astype(np.float32)
+
+
+def _spherical_kmeans(x: np.ndarray, k: int, *, iters: int, rng: np.random.Generator) -> np.ndarray:
+    n = x.shape[0]
+    centroids = x[rng.choice(n, size=k, replace=False)].copy()
+    for _ in range(max(1, iters)):
+        assign = _assign(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        nonempty = np.nonzero(counts)[0]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums[nonempty] = np.add.reduceat(x[order], starts, axis=0)
+        centroids = _normalize_rows(sums)
+        empty = np.nonzero(counts == 0)[0]
+        if empty.size:
+            centroids[empty] = x[rng.choice(n, size=empty.size, replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, dim: int, *, nlist: int = 0, nprobe: int = 0, seed: int = 0) -> None:
+        self.dim = int(dim)
+        self.nlist = max(0, int(nlist))
+        self.nprobe = max(0, int(nprobe))
+        self._seed = int(seed)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._cache: List[Optional[np.ndarray]] = []
+        self._lock = threading.Lock()
+        self.trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(l) for l in self._lists)
+
+    def _auto_nlist(self, n: int) -> int:
+        if self.nlist > 0:
+            return min(self.nlist, n)
+        return max(1, min(4096, n, int(4 * np.sqrt(n))))
+
+    def train(self, mat: np.ndarray, *, iters: int = 12, sample: int = 65536) -> None:
+        n = int(mat.shape[0])
+        if n == 0:
+            return
+        rng = np.random.default_rng(self._seed)
+        x = mat if n <= sample else mat[np.sort(rng.choice(n, size=sample, replace=False))]
+        k = min(self._auto_nlist(n), int(x.shape[0]))
+        self._centroids = _spherical_kmeans(np.asarray(x, dtype=np.float32), k, iters=iters, rng=rng)
+        self._set_assignments(_assign(mat, self._centroids))
+        self.trained_size = n
+
+    def _set_assignments(self, assign: np.ndarray) -> None:
+        k = 0 if self._centroids is None else self._centroids.shape[0]
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        lists = [order[bounds[c] : bounds[c + 1]].tolist() for c in range(k)]
+        with self._lock:
+            self._lists = lists
+            self._cache = [None] * k
+
+    def add(self, pos: int, vec: np.ndarray) -> None:
+        if self._centroids is None:
+            return
+        c = int(np.argmax(self._centroids @ vec))
+        with self._lock:
+            self._lists[c].append(int(pos))
+            self._cache[c] = None
+
+    def candidates(self, q: np.ndarray, *, nprobe: Optional[int] = None) -> np.ndarray:
+        if self._centroids is None:
+            return np.empty(0, dtype=np.int64)
+        k = self._centroids.shape[0]
+        p = int(nprobe or self.nprobe) or int(np.ceil(k * _AUTO_PROBE_FRACTION))
+        p = min(k, max(1, p))
+        sims = self._centroids @ q
+        probe = np.argpartition(-sims, p - 1)[:p] if p < k else np.arange(k)
+        parts = []
+        with self._lock:
+            for c in probe:
+                arr = self._cache[c]
+                if arr is None:
+                    arr = np.asarray(self._lists[c], dtype=np.int64)
+                    self._cache[c] = arr
+                parts.append(arr)
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
+
+    def assignments(self, n: int) -> np.ndarray:
+        out = np.full(n, -1, dtype=np.int32)
+        with self._lock:
+            lists = [list(lst) for lst in self._lists]
+        for c, lst in enumerate(lists):
+            if lst:
+                idx = np.asarray(lst, dtype=np.int64)
+                out[idx[idx < n]] = c
+        return out
+
+    def compacted(self, alive: np.ndarray, mat: np.ndarray) -> "IVFIndex":
+        out = IVFIndex(self.dim, nlist=self.nlist, nprobe=self.nprobe, seed=self._seed)
+        if self._centroids is None:
+            return out
+        out._centroids = self._centroids
+        out.trained_size = self.trained_size
+        assign = self.assignments(alive.shape[0])[alive]
+        missing = np.nonzero(assign < 0)[0]
+        if missing.size:
+            assign[missing] = _assign(mat[missing], self._centroids)
+        out._set_assignments(assign)
+        return out
+
+    def save(self, path: str, keys: np.ndarray) -> None:
+        if self._centroids is None:
+            return
+        n = int(keys.shape[0])
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            centroids=self._centroids,
+            keys=np.asarray(keys, dtype=np.int64),
+            assign=self.assignments(n),
+            trained_size=np.int64(self.trained_size),
+        )
+        os.replace(tmp, path)
+
+    def load(self, path: str, keys: np.ndarray, mat: np.ndarray) -> bool:
+        try:
+            with np.load(path) as data:
+                centroids = np.asarray(data["centroids"], dtype=np.float32)
+                saved_keys = np.asarray(data["keys"], dtype=np.int64)
+                saved_assign = np.asarray(data["assign"], dtype=np.int32)
+                trained_size = int(data["trained_size"])
+        except (OSError, KeyError, ValueError):
+            return False
+        if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+            return False
+        self._centroids = centroids
+        self.trained_size = trained_size
+        order = np.argsort(saved_keys, kind="stable")
+        sk = saved_keys[order]
+        if sk.shape[0]:
+            idx = np.minimum(np.searchsorted(sk, keys), sk.shape[0] - 1)
+            found = sk[idx] == keys
+        else:
+            idx = np.zeros(keys.shape[0], dtype=np.int64)
+            found = np.zeros(keys.shape[0], dtype=bool)
+        assign = np.full(keys.shape[0], -1, dtype=np.int32)
+        assign[found] = saved_assign[order][idx[found]]
+        missing = np.nonzero(assign < 0)[0]
+        if missing.size:
+            assign[missing] = _assign(mat[missing], centroids)
+        self._set_assignments(assign)
+        return True
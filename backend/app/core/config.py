@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List
 
 from dotenv import load_dotenv
 
@@ -21,6 +21,35 @@ class Settings:
     memory_db_path: str
     mmr_lambda: float
     mmr_pool_mult: int
+    entity_boost: float
+    memory_resident_cache: bool
+    memory_mmap_size: int
+    memory_cache_size: int
+    memory_ann_min_chunks: int
+    memory_ann_nlist: int
+    memory_ann_nprobe: int
+    memory_emb_format: str
+    memory_fts: bool
+    memory_hybrid_search: bool
+    memory_query_cache_size: int
+    memory_entity_cache_size: int
+    memory_max_chunks: int
+    memory_max_age_days: float
+    memory_source_quotas: Dict[str, int]
+    memory_maintenance_interval_s: float
+    memory_maintenance_batch: int
+    memory_vacuum_pages: int
+    memory_dedup: str
+    memory_dedup_max_distance: int
+    memory_namespaces: bool
+    memory_namespace_dir: str
+    memory_namespace_max_open: int
+    memory_namespace_keys: Dict[str, str]
+    memory_namespace_idle_days: float
+    memory_write_behind: bool
+    memory_write_queue: int
+    memory_write_batch: int
+    memory_snapshot: bool
     dashscope_api_key: str
     dashscope_workspace: str
     dashscope_base_url: str
@@ -34,6 +63,10 @@ class Settings:
     enable_kimi: bool
     enable_kimi_tools: bool
     kimi_max_prompt_tokens: int
+    prompt_packing: str
+    prompt_recency_decay: float
+    tokenizer_path: str
+    tokenizer_cache_size: int
     waitk_chars: int
     waitk_min_interval_ms: int
     waitk_max_updates: int
@@ -65,6 +98,24 @@ def _parse_origins(value: str | None) -> List[str]:
     return [p for p in parts if p]
 
 
+def _parse_namespace_keys(value: str | None) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for part in (value or "").split(","):
+        key, sep, ns = part.partition("=")
+        if sep and key.strip() and ns.strip():
+            out[key.strip()] = ns.strip()
+    return out
+
+
+def _parse_quotas(value: str | None) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in (value or "").split(","):
+        key, sep, num = part.partition("=")
+        if sep and key.strip() and num.strip():
+            out[key.strip()] = max(0, int(num.strip()))
+    return out
+
+
 def get_settings() -> Settings:
     load_dotenv()
     return Settings(
@@ -80,6 +131,35 @@ def get_settings() -> Settings:
         memory_db_path=os.getenv("STREAMVIS_MEMORY_DB_PATH", "data/streamvis_memory.sqlite"),
         mmr_lambda=float(os.getenv("STREAMVIS_MMR_LAMBDA", "0.65")),
         mmr_pool_mult=int(os.getenv("STREAMVIS_MMR_POOL_MULT", "4")),
+        entity_boost=float(os.getenv("STREAMVIS_ENTITY_BOOST", "0.3")),
+        memory_resident_cache=os.getenv("STREAMVIS_MEMORY_RESIDENT_CACHE", "1").strip() in {"1", "true", "True"},
+        memory_mmap_size=int(os.getenv("STREAMVIS_MEMORY_MMAP_SIZE", "268435456")),
+        memory_cache_size=int(os.getenv("STREAMVIS_MEMORY_CACHE_SIZE", "-65536")),
+        memory_ann_min_chunks=int(os.getenv("STREAMVIS_MEMORY_ANN_MIN_CHUNKS", "0")),
+        memory_ann_nlist=int(os.getenv("STREAMVIS_MEMORY_ANN_NLIST", "0")),
+        memory_ann_nprobe=int(os.getenv("STREAMVIS_MEMORY_ANN_NPROBE", "0")),
+        memory_emb_format=os.getenv("STREAMVIS_MEMORY_EMB_FORMAT", "f32").strip().lower(),
+        memory_fts=os.getenv("STREAMVIS_MEMORY_FTS", "1").strip() in {"1", "true", "True"},
+        memory_hybrid_search=os.getenv("STREAMVIS_MEMORY_HYBRID_SEARCH", "0").strip() in {"1", "true", "True"},
+        memory_query_cache_size=int(os.getenv("STREAMVIS_MEMORY_QUERY_CACHE_SIZE", "256")),
+        memory_entity_cache_size=int(os.getenv("STREAMVIS_MEMORY_ENTITY_CACHE_SIZE", "1024")),
+        memory_max_chunks=int(os.getenv("STREAMVIS_MEMORY_MAX_CHUNKS", "0")),
+        memory_max_age_days=float(os.getenv("STREAMVIS_MEMORY_MAX_AGE_DAYS", "0")),
+        memory_source_quotas=_parse_quotas(os.getenv("STREAMVIS_MEMORY_SOURCE_QUOTAS")),
+        memory_maintenance_interval_s=float(os.getenv("STREAMVIS_MEMORY_MAINTENANCE_INTERVAL_S", "300")),
+        memory_maintenance_batch=int(os.getenv("STREAMVIS_MEMORY_MAINTENANCE_BATCH", "1000")),
+        memory_vacuum_pages=int(os.getenv("STREAMVIS_MEMORY_VACUUM_PAGES", "4096")),
+        memory_dedup=os.getenv("STREAMVIS_MEMORY_DEDUP", "off").strip().lower(),
+        memory_dedup_max_distance=int(os.getenv("STREAMVIS_MEMORY_DEDUP_MAX_DISTANCE", "3")),
+        memory_namespaces=os.getenv("STREAMVIS_MEMORY_NAMESPACES", "0").strip() in {"1", "true", "True"},
+        memory_namespace_dir=os.getenv("STREAMVIS_MEMORY_NAMESPACE_DIR", "data/memory_ns"),
+        memory_namespace_max_open=int(os.getenv("STREAMVIS_MEMORY_NAMESPACE_MAX_OPEN", "32")),
+        memory_namespace_keys=_parse_namespace_keys(os.getenv("STREAMVIS_MEMORY_NAMESPACE_KEYS")),
+        memory_namespace_idle_days=float(os.getenv("STREAMVIS_MEMORY_NAMESPACE_IDLE_DAYS", "0")),
+        memory_write_behind=os.getenv("STREAMVIS_MEMORY_WRITE_BEHIND", "1").strip() in {"1", "true", "True"},
+        memory_write_queue=int(os.getenv("STREAMVIS_MEMORY_WRITE_QUEUE", "4096")),
+        memory_write_batch=int(os.getenv("STREAMVIS_MEMORY_WRITE_BATCH", "512")),
+        memory_snapshot=os.getenv("STREAMVIS_MEMORY_SNAPSHOT", "1").strip() in {"1", "true", "True"},
         dashscope_api_key=os.getenv("DASHSCOPE_API_KEY", ""),
         dashscope_workspace=os.getenv("DASHSCOPE_WORKSPACE", ""),
         dashscope_base_url=os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com"),
@@ -93,6 +173,10 @@ def get_settings() -> Settings:
         enable_kimi=os.getenv("STREAMVIS_ENABLE_KIMI", "0").strip() in {"1", "true", "True"},
         enable_kimi_tools=os.getenv("STREAMVIS_ENABLE_KIMI_TOOLS", "0").strip() in {"1", "true", "True"},
         kimi_max_prompt_tokens=int(os.getenv("STREAMVIS_KIMI_MAX_PROMPT_TOKENS", "5200")),
+        prompt_packing=os.getenv("STREAMVIS_PROMPT_PACKING", "recency").strip().lower(),
+        prompt_recency_decay=float(os.getenv("STREAMVIS_PROMPT_RECENCY_DECAY", "0.85")),
+        tokenizer_path=os.getenv("STREAMVIS_TOKENIZER_PATH", "").strip(),
+        tokenizer_cache_size=int(os.getenv("STREAMVIS_TOKENIZER_CACHE_SIZE", "65536")),
         waitk_chars=int(os.getenv("STREAMVIS_WAITK_CHARS", "120")),
         waitk_min_interval_ms=int(os.getenv("STREAMVIS_WAITK_MIN_INTERVAL_MS", "700")),
         waitk_max_updates=int(os.getenv("STREAMVIS_WAITK_MAX_UPDATES", "4")),
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import logging
+import math
 import uuid
 from collections import deque
-from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 from app.core.segmenter import StreamingSegmenter, extract_entities
-from app.core.token_budget import budget_messages, estimate_tokens
-from app.core.vector_store import InMemoryVectorStore, MemoryChunk
+from app.core.token_budget import MessageRecord, budget_messages, estimate_tokens, pack_messages
+from app.core.vector_store import MemoryChunk, NumpyVectorStore, merge_scored
+
+logger = logging.getLogger("streamvis")
+
 
 class ContextManager:
     def __init__(
@@ -17,32 +22,43 @@ class ContextManager:
         retrieval_k: int = 4,
         mmr_lambda: float = 0.65,
         mmr_pool_mult: int = 4,
+        hybrid_search: bool = False,
+        entity_boost: float = 0.3,
+        packing: str = "recency",
+        recency_decay: float = 0.85,
         segmenter: Optional[StreamingSegmenter] = None,
         store: Optional[Any] = None,
+        writer: Optional[Any] = None,
+        session: Optional[str] = None,
     ) -> None:
         self._l1_max_turns = max(2, int(l1_max_turns))
         self._sink_turns = max(0, int(sink_turns))
         self._retrieval_k = max(0, int(retrieval_k))
         self._mmr_lambda = float(mmr_lambda)
         self._mmr_pool_mult = max(1, int(mmr_pool_mult))
-
-        self._sink: List[Dict[str, Any]] = []
-        self._system: List[Dict[str, Any]] = []
-        self._recent: Deque[Dict[str, Any]] = deque()
+        self._hybrid_search = bool(hybrid_search)
+        self._entity_boost = max(0.0, float(entity_boost))
+        self._packing = packing if packing in {"recency", "relevance"} else "recency"
+        self._recency_decay = min(1.0, max(0.0, float(recency_decay)))
+
+        self._sink: List[MessageRecord] = []
+        self._system: Deque[MessageRecord] = deque()
+        self._recent: Deque[MessageRecord] = deque()
+        self._tier_tokens: Dict[str, int] = {"sink": 0, "system": 0, "recent": 0, "memory": 0}
         self._segmenter = segmenter or StreamingSegmenter()
-        self._store = store or InMemoryVectorStore()
+        self._store = store or NumpyVectorStore()
         self._owns_store = store is None
-        self._entity_index: Dict[str, List[str]] = {}
-        self._warm_entity_index()
+        self._writer = writer
+        self._session = session
 
     def clear(self, *, preserve_long_term: bool = True) -> None:
         self._sink.clear()
         self._system.clear()
         self._recent.clear()
+        self._tier_tokens = dict.fromkeys(self._tier_tokens, 0)
         self._segmenter.flush()
         if not preserve_long_term and self._owns_store:
-            self._store = InMemoryVectorStore()
-            self._entity_index.clear()
+            self._store = NumpyVectorStore()
 
     def add_user_input(self, text: str) -> None:
         self._append({"role": "user", "content": text})
@@ -54,30 +70,64 @@ class ContextManager:
         t = (text or "").strip()
         if not t:
             return
-        self._system.append({"role": "system", "content": t})
+        rec = MessageRecord.build("system", t, cached=True)
+        self._system.append(rec)
+        self._tier_tokens["system"] += rec.tokens
         while len(self._system) > 8:
-            self._system.pop(0)
+            self._tier_tokens["system"] -= self._system.popleft().tokens
 
     def get_recent_context(self, k: int = 6) -> List[Dict[str, Any]]:
         if k <= 0:
             return []
-        return list(self._recent)[-k:]
+        return [r.to_message() for r in list(self._recent)[-k:]]
 
     def get_sink_context(self) -> List[Dict[str, Any]]:
-        return list(self._sink)
+        return [r.to_message() for r in self._sink]
+
+    def token_totals(self) -> Dict[str, int]:
+        out = dict(self._tier_tokens)
+        out["total"] = sum(out.values())
+        return out
 
     def get_augmented_context(self, query: str, *, max_prompt_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
         k = self._effective_retrieval_k(query, max_prompt_tokens=max_prompt_tokens)
-        retrieved = self.retrieve(query, k=k)
-        mem_msgs: List[Dict[str, Any]] = []
-        for ch in retrieved:
-            mem_msgs.append({"role": "system", "content": f"[Memory:{ch.id}] {ch.text}"})
-        msgs = self.get_sink_context() + list(self._system) + mem_msgs + list(self._recent)
+        retrieved = self.retrieve_scored(query, k=k)
+        mem = [MessageRecord.build("system", f"[Memory:{ch.id}] {ch.text}", cached=True) for _, ch in retrieved]
+        self._tier_tokens["memory"] = sum(r.tokens for r in mem)
+        records = self._sink + list(self._system) + mem + list(self._recent)
+        msgs = [r.to_message() for r in records]
         if max_prompt_tokens is None:
             return msgs
-        budgeted, _ = budget_messages(msgs, max_prompt_tokens=max_prompt_tokens, keep_last_n=6, max_single_message_tokens=900)
+        if self._packing == "relevance":
+            scores = self._packing_scores([sc for sc, _ in retrieved])
+            packed, _ = pack_messages(
+                msgs,
+                scores,
+                max_prompt_tokens=max_prompt_tokens,
+                keep_last_n=6,
+                max_single_message_tokens=900,
+                token_counts=[r.counts for r in records],
+            )
+            return packed
+        budgeted, _ = budget_messages(
+            msgs,
+            max_prompt_tokens=max_prompt_tokens,
+            keep_last_n=6,
+            max_single_message_tokens=900,
+            token_counts=[r.counts for r in records],
+        )
         return budgeted
 
+    def _packing_scores(self, memory_scores: List[float]) -> List[float]:
+        decay = self._recency_decay
+        n_system = len(self._system)
+        n_recent = len(self._recent)
+        scores = [math.inf] * len(self._sink)
+        scores.extend(decay ** (n_system - 1 - i) for i in range(n_system))
+        scores.extend(max(0.0, sc) for sc in memory_scores)
+        scores.extend(0.5 * decay ** (n_recent - 1 - i) for i in range(n_recent))
+        return scores
+
     def _effective_retrieval_k(self, query: str, *, max_prompt_tokens: Optional[int]) -> int:
         base = int(self._retrieval_k)
         if base <= 0:
@@ -93,58 +143,72 @@ class ContextManager:
         return max(0, k_cap)
 
     def retrieve(self, query: str, k: int = 4) -> List[MemoryChunk]:
+        return [ch for _, ch in self.retrieve_scored(query, k=k)]
+
+    def retrieve_scored(self, query: str, k: int = 4) -> List[Tuple[float, MemoryChunk]]:
         if k <= 0:
             return []
-        hits: List[MemoryChunk] = []
         pool = max(k * self._mmr_pool_mult, k)
-
-        ents = extract_entities(query)
-        if ents:
-            seen = set()
-            for e in ents:
-                for cid in self._entity_index.get(e, [])[:k]:
-                    for ch in self._store.search(query, k=pool, mmr_lambda=self._mmr_lambda, candidate_pool=pool):
-                        if ch.id == cid and ch.id not in seen:
-                            hits.append(ch)
-                            seen.add(ch.id)
-
-        for ch in self._store.search(query, k=k, mmr_lambda=self._mmr_lambda, candidate_pool=pool):
-            if ch not in hits:
-                hits.append(ch)
-
-        return hits[:k]
-
-    def _warm_entity_index(self, *, max_chunks: int = 1200) -> None:
-        try:
-            chunks = list(self._store.iter_chunks())
-        except Exception:
-            return
-        for ch in chunks[: max(0, int(max_chunks))]:
-            meta = ch.meta or {}
-            for e in meta.get("entities", []) or []:
-                self._entity_index.setdefault(str(e), []).append(ch.id)
+        search_scored = getattr(self._store, "search_scored", None)
+        if search_scored is None:
+            hits = self._store.search(query, k, mmr_lambda=self._mmr_lambda, candidate_pool=pool)
+            return [(1.0 / (i + 1), ch) for i, ch in enumerate(hits)]
+        scored = search_scored(query, pool, candidate_pool=pool, hybrid=self._hybrid_search)
+        linked = self._entity_chunk_ids(query, k)
+        if linked:
+            in_pool = {ch.id for _, ch in scored}
+            extra = self._store.score_ids(query, [cid for cid in linked if cid not in in_pool])
+            boost = self._entity_boost
+            scored = [(sc + boost if ch.id in linked else sc, ch) for sc, ch in scored]
+            scored.extend((sc + boost, ch) for sc, ch in extra if sc > 0.0)
+        best = {ch.id: sc for sc, ch in scored}
+        picked = merge_scored([scored], k, mmr_lambda=self._mmr_lambda, candidate_pool=pool)
+        return [(best.get(ch.id, 0.0), ch) for ch in picked]
+
+    def _entity_chunk_ids(self, query: str, k: int) -> Dict[str, None]:
+        entities = extract_entities(query)
+        if not entities or not hasattr(self._store, "entity_chunk_ids") or not hasattr(self._store, "score_ids"):
+            return {}
+        linked: Dict[str, None] = {}
+        for ids in self._store.entity_chunk_ids(entities, k).values():
+            for cid in ids:
+                linked[cid] = None
+        return linked
 
     def _append(self, msg: Dict[str, Any]) -> None:
+        rec = MessageRecord.build(str(msg.get("role") or ""), str(msg.get("content") or ""))
         if len(self._sink) < self._sink_turns:
-            self._sink.append(msg)
+            self._sink.append(rec)
+            self._tier_tokens["sink"] += rec.tokens
             return
 
-        self._recent.append(msg)
+        self._recent.append(rec)
+        self._tier_tokens["recent"] += rec.tokens
         while len(self._recent) > self._l1_max_turns:
             evicted = self._recent.popleft()
+            self._tier_tokens["recent"] -= evicted.tokens
             self._evict_to_long_term(evicted)
 
-    def _evict_to_long_term(self, msg: Dict[str, Any]) -> None:
-        content = (msg.get("content") or "").strip()
+    def _evict_to_long_term(self, rec: MessageRecord) -> None:
+        content = rec.content.strip()
         if not content:
             return
-        role = msg.get("role") or "unknown"
-        segments = self._segmenter.add(content, meta={"role": role})
+        role = rec.role or "unknown"
+        segments = self._segmenter.add(content, meta={"role": role, "source": "chat"})
+        items: List[Tuple[str, str, Dict[str, Any]]] = []
         for seg in segments:
-            cid = seg.id or uuid.uuid4().hex[:12]
-            self._store.add(cid, seg.text, meta=seg.meta)
-            for e in seg.meta.get("entities", []) or []:
-                self._entity_index.setdefault(str(e), []).insert(0, cid)
+            items.append((seg.id or uuid.uuid4().hex[:12], seg.text, seg.meta))
+        if not items:
+            return
+        if self._writer is not None:
+            self._writer.submit(self._store, items, session=self._session).add_done_callback(self._log_lost_write)
+            return
+        self._store.add_many(items)
+
+    def _log_lost_write(self, fut: Any) -> None:
+        if fut.cancelled() or fut.exception() is None:
+            return
+        logger.error("long-term memory write failed session=%s", self._session, exc_info=fut.exception())
 
     def get_context_vector(self) -> List[float]:
         return [0.1, 0.2, 0.3]
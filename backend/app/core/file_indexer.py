@@ -24,26 +24,33 @@ def _chunks_from_text(text: str) -> List[str]:
     return out
 
 
-def index_text(
+def segment_text(
     *,
-    store: Any,
     text: str,
     meta: Optional[Dict[str, Any]] = None,
     segmenter: Optional[StreamingSegmenter] = None,
-) -> Tuple[int, List[str]]:
+) -> List[Tuple[str, str, Dict[str, Any]]]:
     seg = segmenter or StreamingSegmenter(min_chars=80, max_chars=760, boundary_similarity=0.25, max_turns=12)
-    ids: List[str] = []
-    count = 0
+    items: List[Tuple[str, str, Dict[str, Any]]] = []
     for part in _chunks_from_text(text):
         for s in seg.add(part, meta=meta):
-            cid = s.id or uuid.uuid4().hex[:12]
-            store.add(cid, s.text, meta=s.meta)
-            ids.append(cid)
-            count += 1
+            items.append((s.id or uuid.uuid4().hex[:12], s.text, s.meta))
     for s in seg.flush(meta=meta):
-        cid = s.id or uuid.uuid4().hex[:12]
-        store.add(cid, s.text, meta=s.meta)
-        ids.append(cid)
-        count += 1
-    return count, ids
+        items.append((s.id or uuid.uuid4().hex[:12], s.text, s.meta))
+    return items
+
 
+def stored_ids(stored: Optional[List[str]], items: List[Tuple[str, str, Dict[str, Any]]]) -> List[str]:
+    return list(dict.fromkeys(stored)) if stored is not None else [cid for cid, _, _ in items]
+
+
+def index_text(
+    *,
+    store: Any,
+    text: str,
+    meta: Optional[Dict[str, Any]] = None,
+    segmenter: Optional[StreamingSegmenter] = None,
+) -> Tuple[int, List[str]]:
+    items = segment_text(text=text, meta=meta, segmenter=segmenter)
+    ids = stored_ids(store.add_many(items), items)
+    return len(ids), ids
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.vector_store import MemoryChunk, PersistentVectorStore, merge_scored
+
+
+GLOBAL_NAMESPACE = "global"
+
+_RE_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _file_stem(namespace: str) -> str:
+    slug = _RE_UNSAFE.sub("_", namespace).strip("._")[:64]
+    if slug == namespace:
+        return slug
+    return f"{slug or 'ns'}-{hashlib.md5(namespace.encode('utf-8')).hexdigest()[:10]}"
+
+
+class MemoryNamespaces:
+    def __init__(
+        self,
+        *,
+        base_dir: str,
+        factory: Callable[[str], PersistentVectorStore],
+        global_store: Optional[PersistentVectorStore] = None,
+        max_open: int = 32,
+    ) -> None:
+        self._base_dir = os.path.abspath(base_dir)
+        os.makedirs(self._base_dir, exist_ok=True)
+        self._factory = factory
+        self._global = global_store
+        self._max_open = max(1, int(max_open))
+        self._open: "OrderedDict[str, PersistentVectorStore]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self._opening: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def normalize(self, namespace: Optional[str]) -> str:
+        ns = (namespace or "").strip()
+        return ns or GLOBAL_NAMESPACE
+
+    def path_for(self, namespace: str) -> str:
+        return os.path.join(self._base_dir, _file_stem(namespace) + ".sqlite")
+
+    @contextmanager
+    def lease(self, namespace: Optional[str]) -> Iterator[PersistentVectorStore]:
+        ns = self.normalize(namespace)
+        if ns == GLOBAL_NAMESPACE and self._global is not None:
+            yield self._global
+            return
+        store = self._acquire(ns)
+        try:
+            yield store
+        finally:
+            with self._lock:
+                self._refs[ns] -= 1
+                victims = self._trim()
+            for victim in victims:
+                victim.close()
+
+    def _acquire(self, ns: str) -> PersistentVectorStore:
+        while True:
+            with self._lock:
+                store = self._open.get(ns)
+                if store is not None:
+                    self._open.move_to_end(ns)
+                    self._refs[ns] = self._refs.get(ns, 0) + 1
+                    return store
+                pending = self._opening.get(ns)
+                owner = pending is None
+                if owner:
+                    pending = self._opening[ns] = threading.Event()
+            if not owner:
+                pending.wait()
+                continue
+            try:
+                store = self._factory(self.path_for(ns))
+            except BaseException:
+                with self._lock:
+                    self._opening.pop(ns).set()
+                raise
+            with self._lock:
+                self._open[ns] = store
+                self._refs[ns] = self._refs.get(ns, 0) + 1
+                self._opening.pop(ns).set()
+            return store
+
+    def _trim(self) -> List[PersistentVectorStore]:
+        victims: List[PersistentVectorStore] = []
+        for ns in list(self._open):
+            if len(self._open) <= self._max_open:
+                break
+            if self._refs.get(ns, 0) == 0:
+                victims.append(self._open.pop(ns))
+                self._refs.pop(ns, None)
+        return victims
+
+    def sweep(self, keep: Iterable[str], *, max_idle_s: float) -> List[str]:
+        if max_idle_s <= 0:
+            return []
+        cutoff = time.time() - float(max_idle_s)
+        with self._lock:
+            busy = {_file_stem(ns) for ns in [*self._open, *self._opening, *keep]}
+        groups: Dict[str, List[str]] = {}
+        for name in os.listdir(self._base_dir):
+            stem, sep, _ = name.partition(".sqlite")
+            if sep and stem not in busy:
+                groups.setdefault(stem, []).append(os.path.join(self._base_dir, name))
+        removed: List[str] = []
+        for stem, paths in sorted(groups.items()):
+            try:
+                if max(os.path.getmtime(p) for p in paths) > cutoff:
+                    continue
+            except OSError:
+                continue
+            for path in paths:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            removed.append(stem)
+        return removed
+
+    def open_namespaces(self) -> List[str]:
+        with self._lock:
+            return list(self._open)
+
+    def view(self, *, write: Optional[str], read: Sequence[Optional[str]]) -> "NamespacedStore":
+        return NamespacedStore(self, write=write, read=read)
+
+    def maintain_open(self, **kwargs: Any) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for ns in self.open_namespaces():
+            with self.lease(ns) as store:
+                out[ns] = store.maintain(**kwargs)
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            stores = list(self._open.values())
+            self._open.clear()
+            self._refs.clear()
+        for store in stores:
+            store.close()
+
+
+class NamespacedStore:
+    def __init__(self, registry: MemoryNamespaces, *, write: Optional[str], read: Sequence[Optional[str]]) -> None:
+        self._registry = registry
+        self._write = registry.normalize(write)
+        self._read = list(dict.fromkeys(registry.normalize(ns) for ns in read)) or [self._write]
+
+    @property
+    def write_namespace(self) -> str:
+        return self._write
+
+    @property
+    def read_namespaces(self) -> List[str]:
+        return list(self._read)
+
+    def add(self, chunk_id: str, text: str, meta: Optional[Dict[str, Any]] = None) -> None:
+        with self._registry.lease(self._write) as store:
+            store.add(chunk_id, text, meta=meta)
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[str]:
+        with self._registry.lease(self._write) as store:
+            return store.add_many(items)
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        *,
+        mmr_lambda: float = 0.0,
+        candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
+    ) -> List[MemoryChunk]:
+        if k <= 0:
+            return []
+        pool_scored = self.search_scored(query, k, filters, candidate_pool=candidate_pool, hybrid=hybrid)
+        return merge_scored([pool_scored], k, mmr_lambda=mmr_lambda, candidate_pool=candidate_pool)
+
+    def search_scored(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        *,
+        candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
+    ) -> List[Tuple[float, MemoryChunk]]:
+        if k <= 0:
+            return []
+        merged: List[Tuple[float, MemoryChunk]] = []
+        for ns in self._read:
+            with self._registry.lease(ns) as store:
+                merged.extend(store.search_scored(query, k, filters, candidate_pool=candidate_pool, hybrid=hybrid))
+        merged.sort(key=lambda t: t[0], reverse=True)
+        return merged
+
+    def score_ids(self, query: str, ids: Sequence[str]) -> List[Tuple[float, MemoryChunk]]:
+        found: Dict[str, Tuple[float, MemoryChunk]] = {}
+        for ns in self._read:
+            missing = [cid for cid in ids if cid not in found]
+            if not missing:
+                break
+            with self._registry.lease(ns) as store:
+                for sc, ch in store.score_ids(query, missing):
+                    found[ch.id] = (sc, ch)
+        return [found[cid] for cid in dict.fromkeys(ids) if cid in found]
+
+    def entity_chunk_ids(self, entities: Sequence[str], limit: int = 4) -> Dict[str, List[str]]:
+        out: Dict[str, List[str]] = {e: [] for e in dict.fromkeys(entities)}
+        for ns in self._read:
+            with self._registry.lease(ns) as store:
+                for e, ids in store.entity_chunk_ids(list(out), limit).items():
+                    out[e].extend(cid for cid in ids if cid not in out[e])
+        return {e: ids[:limit] for e, ids in out.items()}
+
+    def iter_chunks(self) -> Iterable[MemoryChunk]:
+        for ns in self._read:
+            with self._registry.lease(ns) as store:
+                yield from store.iter_chunks()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+_Item = Tuple[str, str, Dict[str, Any]]
+_Job = Tuple[Any, List[_Item], "asyncio.Future[List[str]]"]
+
+
+def _observe(fut: "asyncio.Future[List[str]]") -> None:
+    if not fut.cancelled():
+        fut.exception()
+
+
+class MemoryWriter:
+    def __init__(self, *, max_queue: int = 4096, max_batch: int = 512, max_inline: int = 2) -> None:
+        self._max_queue = max(1, int(max_queue))
+        self._max_batch = max(1, int(max_batch))
+        self._inline_slots = asyncio.Semaphore(max(1, int(max_inline)))
+        self._queue: Optional["asyncio.Queue[Optional[_Job]]"] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._queued_items = 0
+        self._inline_tasks: Set["asyncio.Task[None]"] = set()
+        self._pending: Dict[str, Set["asyncio.Future[List[str]]"]] = {}
+        self._counts = {"jobs": 0, "items": 0, "batches": 0, "inline": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._queued_items = 0
+        self._task = asyncio.get_running_loop().create_task(self._run(self._queue), name="streamvis-memory-writer")
+
+    def stats(self) -> Dict[str, int]:
+        out = dict(self._counts)
+        out["queued"] = self._queue.qsize() if self._queue is not None else 0
+        out["queued_items"] = self._queued_items
+        return out
+
+    def submit(self, store: Any, items: List[_Item], *, session: Optional[str] = None) -> "asyncio.Future[List[str]]":
+        loop = asyncio.get_running_loop()
+        fut: "asyncio.Future[List[str]]" = loop.create_future()
+        fut.add_done_callback(_observe)
+        batch = list(items)
+        self._counts["jobs"] += 1
+        self._counts["items"] += len(batch)
+        if not batch:
+            fut.set_result([])
+            return fut
+        if session:
+            pending = self._pending.setdefault(session, set())
+            pending.add(fut)
+            fut.add_done_callback(lambda f, s=session: self._forget(s, f))
+        full = self._queued_items > 0 and self._queued_items + len(batch) > self._max_queue
+        if not self.running or self._queue is None or full:
+            task = loop.create_task(self._write_inline(store, batch, fut))
+            self._inline_tasks.add(task)
+            task.add_done_callback(self._inline_tasks.discard)
+            return fut
+        self._queued_items += len(batch)
+        self._queue.put_nowait((store, batch, fut))
+        return fut
+
+    async def _write_inline(self, store: Any, batch: List[_Item], fut: "asyncio.Future[List[str]]") -> None:
+        self._counts["inline"] += 1
+        try:
+            async with self._inline_slots:
+                stored = await asyncio.to_thread(store.add_many, batch)
+        except Exception as e:
+            self._counts["errors"] += 1
+            if not fut.done():
+                fut.set_exception(e)
+            return
+        if not fut.done():
+            fut.set_result(list(stored or [cid for cid, _, _ in batch]))
+
+    def _forget(self, session: str, fut: "asyncio.Future[List[str]]") -> None:
+        pending = self._pending.get(session)
+        if pending is None:
+            return
+        pending.discard(fut)
+        if not pending:
+            self._pending.pop(session, None)
+
+    async def wait_session(self, session: str) -> None:
+        pending = list(self._pending.get(session, ()))
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def flush(self) -> None:
+        if self._queue is not None and self.running:
+            await self._queue.join()
+        if self._inline_tasks:
+            await asyncio.gather(*list(self._inline_tasks), return_exceptions=True)
+
+    async def close(self) -> None:
+        if self._queue is None or self._task is None:
+            return
+        if self.running:
+            await self._queue.put(None)
+            await self._task
+        if self._inline_tasks:
+            await asyncio.gather(*list(self._inline_tasks), return_exceptions=True)
+        self._task = None
+        self._queue = None
+        self._queued_items = 0
+
+    async def _run(self, queue: "asyncio.Queue[Optional[_Job]]") -> None:
+        stop = False
+        while not stop:
+            jobs: List[_Job] = []
+            size = 0
+            taken = 0
+            job = await queue.get()
+            while True:
+                taken += 1
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+                size += len(job[1])
+                if size >= self._max_batch or queue.empty():
+                    break
+                job = queue.get_nowait()
+            try:
+                if jobs:
+                    await self._write(jobs)
+            finally:
+                self._queued_items -= size
+                for _ in range(taken):
+                    queue.task_done()
+
+    async def _write(self, jobs: List[_Job]) -> None:
+        groups: Dict[int, Tuple[Any, List[_Job]]] = {}
+        for job in jobs:
+            groups.setdefault(id(job[0]), (job[0], []))[1].append(job)
+        for store, group in groups.values():
+            merged = [item for _, items, _ in group for item in items]
+            self._counts["batches"] += 1
+            try:
+                stored = await asyncio.to_thread(store.add_many, merged)
+            except Exception as e:
+                self._counts["errors"] += 1
+                for _, _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            stored = list(stored or [cid for cid, _, _ in merged])
+            offset = 0
+            for _, items, fut in group:
+                if not fut.done():
+                    fut.set_result(stored[offset : offset + len(items)])
+                offset += len(items)
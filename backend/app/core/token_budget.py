@@ -1,42 +1,114 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+import functools
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from app.core.tokenizer import BPETokenizer, HeuristicTokenizer, load_tokenizer
+
+_HEURISTIC = HeuristicTokenizer()
+_tokenizer: Union[HeuristicTokenizer, BPETokenizer] = _HEURISTIC
+
+
+def configure_tokenizer(path: str = "", *, cache_size: int = 65536) -> Union[HeuristicTokenizer, BPETokenizer]:
+    global _tokenizer
+    _tokenizer = load_tokenizer(path, cache_size=cache_size) or _HEURISTIC
+    estimate_tokens_cached.cache_clear()
+    return _tokenizer
+
+
+def get_tokenizer() -> Union[HeuristicTokenizer, BPETokenizer]:
+    return _tokenizer
 
 
 def estimate_tokens(text: str) -> int:
     s = text or ""
     if not s:
         return 0
-    ascii_count = 0
-    non_ascii_count = 0
-    for ch in s:
-        if ord(ch) < 128:
-            ascii_count += 1
-        else:
-            non_ascii_count += 1
-    return max(1, int(ascii_count / 4.0 + non_ascii_count / 1.5))
+    return _tokenizer.count(s)
+
+
+def estimate_tokens_many(texts: Iterable[str]) -> List[int]:
+    return _tokenizer.count_many(t or "" for t in texts)
 
 
-def estimate_message_tokens(msg: Dict[str, Any]) -> int:
-    role = str(msg.get("role") or "")
+@functools.lru_cache(maxsize=1024)
+def estimate_tokens_cached(text: str) -> int:
+    return estimate_tokens(text)
+
+
+def _message_text(msg: Dict[str, Any]) -> str:
     content = msg.get("content")
     if isinstance(content, list):
-        joined = ""
-        for part in content:
-            if isinstance(part, dict) and part.get("text"):
-                joined += str(part["text"])
-        content = joined
-    return estimate_tokens(f"{role}:{content}")
+        content = "".join(str(part["text"]) for part in content if isinstance(part, dict) and part.get("text"))
+    return f"{msg.get('role') or ''}:{content}"
+
+
+def estimate_message_tokens(msg: Dict[str, Any], *, cached: bool = False) -> int:
+    return (estimate_tokens_cached if cached else estimate_tokens)(_message_text(msg))
+
+
+def message_token_counts_many(msgs: Sequence[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    contents = [m.get("content") for m in msgs]
+    strs = [c for c in contents if isinstance(c, str)]
+    counts = iter(estimate_tokens_many(strs + [_message_text(m) for m in msgs]))
+    content_counts = [next(counts) if isinstance(c, str) else 0 for c in contents]
+    return [(c, next(counts)) for c in content_counts]
+
+
+def message_token_counts(msg: Dict[str, Any], *, cached: bool = False) -> Tuple[int, int]:
+    content = msg.get("content")
+    if not isinstance(content, str):
+        return 0, estimate_message_tokens(msg, cached=cached)
+    return (estimate_tokens_cached if cached else estimate_tokens)(content), estimate_message_tokens(msg, cached=cached)
+
+
+@dataclass(frozen=True)
+class MessageRecord:
+    role: str
+    content: str
+    content_tokens: int
+    tokens: int
+
+    @classmethod
+    def build(cls, role: str, content: str, *, cached: bool = False) -> "MessageRecord":
+        content_tokens, tokens = message_token_counts({"role": role, "content": content}, cached=cached)
+        return cls(role=role, content=content, content_tokens=content_tokens, tokens=tokens)
+
+    @property
+    def counts(self) -> Tuple[int, int]:
+        return self.content_tokens, self.tokens
+
+    def to_message(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content}
 
 
 def truncate_text_to_tokens(text: str, max_tokens: int) -> str:
+    return _tokenizer.truncate(text or "", max_tokens)
+
+
+_SENTENCE_END = re.compile(r"[。！？；!?;\n]+[”’」』）)\"']*\s*|\.(?:\s+|$)")
+
+
+def truncate_text_to_sentences(text: str, max_tokens: int, *, fallback: bool = True) -> str:
     if max_tokens <= 0:
         return ""
     s = text or ""
     if estimate_tokens(s) <= max_tokens:
         return s
-    limit_chars = max(24, int(max_tokens * 3.2))
-    return s[:limit_chars]
+    ends = [m.end() for m in _SENTENCE_END.finditer(s)]
+    lo, hi = 0, len(ends)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(s[: ends[mid - 1]]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    if lo == 0:
+        return truncate_text_to_tokens(s, max_tokens) if fallback else ""
+    return s[: ends[lo - 1]].rstrip()
 
 
 def budget_messages(
@@ -45,34 +117,123 @@ def budget_messages(
     max_prompt_tokens: int,
     keep_last_n: int = 4,
     max_single_message_tokens: int = 900,
+    token_counts: Optional[Sequence[Tuple[int, int]]] = None,
 ) -> Tuple[List[Dict[str, Any]], int]:
-    if max_prompt_tokens <= 0:
+    if max_prompt_tokens <= 0 or not msgs:
         return [], 0
+    if token_counts is None:
+        token_counts = message_token_counts_many(msgs)
+    elif len(token_counts) != len(msgs):
+        raise ValueError("token_counts must match msgs")
+
+    tail_start = max(0, len(msgs) - keep_last_n) if keep_last_n > 0 else len(msgs)
+    truncated: Dict[int, Dict[str, Any]] = {}
+    keep: List[int] = []
+    total = 0
+    for i in range(len(msgs) - 1, -1, -1):
+        content_tokens, t = token_counts[i]
+        if content_tokens > max_single_message_tokens:
+            truncated[i] = _truncated(msgs[i], max_single_message_tokens)
+            t = estimate_message_tokens(truncated[i])
+        if i < tail_start and total + t > max_prompt_tokens:
+            continue
+        keep.append(i)
+        total += t
+    keep.reverse()
+    return [truncated[i] if i in truncated else dict(msgs[i]) for i in keep], total
 
-    trimmed: List[Dict[str, Any]] = []
-    for m in msgs:
-        mm = dict(m)
-        content = mm.get("content")
-        if isinstance(content, str):
-            if estimate_tokens(content) > max_single_message_tokens:
-                mm["content"] = truncate_text_to_tokens(content, max_single_message_tokens)
-        trimmed.append(mm)
-
-    if not trimmed:
-        return [], 0
 
-    kept_tail = trimmed[-keep_last_n:] if keep_last_n > 0 else []
-    head = trimmed[: max(0, len(trimmed) - len(kept_tail))]
+def _truncated(msg: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+    mm = dict(msg)
+    mm["content"] = truncate_text_to_tokens(str(mm.get("content") or ""), max_tokens)
+    return mm
 
-    total = sum(estimate_message_tokens(m) for m in kept_tail)
-    out: List[Dict[str, Any]] = list(kept_tail)
 
-    for m in reversed(head):
-        t = estimate_message_tokens(m)
-        if total + t > max_prompt_tokens:
+def pack_messages(
+    msgs: List[Dict[str, Any]],
+    scores: Sequence[float],
+    *,
+    max_prompt_tokens: int,
+    keep_last_n: int = 4,
+    max_single_message_tokens: int = 900,
+    min_partial_tokens: int = 48,
+    token_counts: Optional[Sequence[Tuple[int, int]]] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    if max_prompt_tokens <= 0 or not msgs:
+        return [], 0
+    if len(scores) != len(msgs):
+        raise ValueError("scores must match msgs")
+    if token_counts is None:
+        token_counts = message_token_counts_many(msgs)
+    elif len(token_counts) != len(msgs):
+        raise ValueError("token_counts must match msgs")
+
+    n = len(msgs)
+    tail_start = max(0, n - keep_last_n) if keep_last_n > 0 else n
+    items: List[Dict[str, Any]] = []
+    sizes: List[int] = []
+    for m, (content_tokens, tokens) in zip(msgs, token_counts):
+        if content_tokens > max_single_message_tokens:
+            m = dict(m)
+            m["content"] = truncate_text_to_sentences(str(m.get("content") or ""), max_single_message_tokens)
+            tokens = estimate_message_tokens(m)
+        items.append(m)
+        sizes.append(tokens)
+
+    chosen: Dict[int, Dict[str, Any]] = {}
+    total = 0
+    for i in range(n):
+        if i >= tail_start or (math.isinf(scores[i]) and scores[i] > 0):
+            chosen[i] = items[i]
+            total += sizes[i]
+    room = max_prompt_tokens - total
+
+    optional = [i for i in range(n) if i not in chosen and scores[i] > 0.0 and sizes[i] > 0]
+    optional.sort(key=lambda i: scores[i] / sizes[i], reverse=True)
+    picked, used, value = _greedy_fill(optional, scores, sizes, items, room, min_partial_tokens)
+    best = max((i for i in optional if sizes[i] <= room), key=lambda i: scores[i], default=None)
+    if best is not None and scores[best] > value:
+        rest = [i for i in optional if i != best]
+        picked, used, _ = _greedy_fill(rest, scores, sizes, items, room - sizes[best], min_partial_tokens)
+        picked[best] = items[best]
+        used += sizes[best]
+    chosen.update(picked)
+    total += used
+    return [chosen[i] if chosen[i] is not msgs[i] else dict(msgs[i]) for i in sorted(chosen)], total
+
+
+def _greedy_fill(
+    order: Sequence[int],
+    scores: Sequence[float],
+    sizes: Sequence[int],
+    items: Sequence[Dict[str, Any]],
+    room: int,
+    min_partial_tokens: int,
+) -> Tuple[Dict[int, Dict[str, Any]], int, float]:
+    picked: Dict[int, Dict[str, Any]] = {}
+    used = 0
+    value = 0.0
+    partial = False
+    for i in order:
+        left = room - used
+        if sizes[i] <= left:
+            picked[i] = items[i]
+            used += sizes[i]
+            value += scores[i]
             continue
-        out.insert(0, m)
-        total += t
-
-    return out, total
-
+        content = items[i].get("content")
+        if partial or left < min_partial_tokens or not isinstance(content, str):
+            continue
+        overhead = max(0, sizes[i] - estimate_tokens(content))
+        part = truncate_text_to_sentences(content, left - overhead, fallback=False)
+        if not part:
+            continue
+        m = dict(items[i])
+        m["content"] = part
+        t = estimate_message_tokens(m)
+        if t <= left:
+            picked[i] = m
+            used += t
+            value += scores[i] * t / sizes[i]
+            partial = True
+    return picked, used, value
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import base64
+import functools
+import heapq
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+_PRETOKENIZE = re.compile(
+    r"[㐀-䶿一-鿿豈-﫿]+"
+    r"|'(?:[sS]|[tT]|[rR][eE]|[vV][eE]|[mM]|[lL][lL]|[dD])"
+    r"| ?[^\W\d_㐀-䶿一-鿿豈-﫿]+"
+    r"|\d{1,3}"
+    r"| ?[^\s\w]+[\r\n]*"
+    r"|\s*[\r\n]+"
+    r"|\s+(?!\S)"
+    r"|\s+"
+)
+_CACHE_MAX_PIECE = 64
+
+
+@functools.lru_cache(maxsize=1)
+def _byte_decoder() -> Dict[str, int]:
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = list(bs)
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return {chr(c): b for b, c in zip(bs, cs)}
+
+
+def _unmap_bytes(token: str) -> bytes:
+    decoder = _byte_decoder()
+    return bytes(decoder[ch] for ch in token)
+
+
+def _read_tiktoken(path: str) -> Dict[bytes, int]:
+    ranks: Dict[bytes, int] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                ranks[base64.b64decode(parts[0])] = int(parts[1])
+    return ranks
+
+
+def _read_vocab_merges(vocab_path: str, merges_path: str) -> Tuple[Dict[Tuple[bytes, bytes], int], Dict[bytes, int]]:
+    with open(vocab_path, "r", encoding="utf-8") as f:
+        vocab: Dict[str, int] = json.load(f)
+    ids: Dict[bytes, int] = {}
+    for token, idx in vocab.items():
+        try:
+            ids[_unmap_bytes(token)] = int(idx)
+        except KeyError:
+            continue
+    ranks: Dict[Tuple[bytes, bytes], int] = {}
+    with open(merges_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split(" ")
+            if len(parts) != 2 or line.startswith("#version"):
+                continue
+            try:
+                pair = (_unmap_bytes(parts[0]), _unmap_bytes(parts[1]))
+            except KeyError:
+                continue
+            ranks.setdefault(pair, len(ranks))
+    return ranks, ids
+
+
+class HeuristicTokenizer:
+    name = "heuristic"
+
+    def __len__(self) -> int:
+        return 0
+
+    def count(self, text: str) -> int:
+        s = text or ""
+        if not s:
+            return 0
+        ascii_count = len(s) if s.isascii() else len(s.encode("ascii", "ignore"))
+        return max(1, int(ascii_count / 4.0 + (len(s) - ascii_count) / 1.5))
+
+    def count_many(self, texts: Iterable[str]) -> List[int]:
+        return [self.count(t) for t in texts]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        s = text or ""
+        if self.count(s) <= max_tokens:
+            return s
+        return s[: max(24, int(max_tokens * 3.2))]
+
+
+class BPETokenizer:
+    name = "bpe"
+
+    def __init__(
+        self,
+        ranks: Dict[bytes, int],
+        *,
+        pair_ranks: Optional[Dict[Tuple[bytes, bytes], int]] = None,
+        ids: Optional[Dict[bytes, int]] = None,
+        cache_size: int = 65536,
+    ) -> None:
+        ids = ranks if ids is None else ids
+        if not (ranks or pair_ranks) or not ids:
+            raise ValueError("empty BPE vocabulary")
+        self._ranks = ranks
+        self._pair_ranks = pair_ranks
+        self._ids = ids
+        self._decoder = {idx: token for token, idx in ids.items()}
+        self._missing = max(ids.values()) + 1
+        self._encode_piece_cached = functools.lru_cache(maxsize=max(0, int(cache_size)))(self._encode_piece)
+
+    @classmethod
+    def from_files(cls, path: str, merges_path: Optional[str] = None, *, cache_size: int = 65536) -> "BPETokenizer":
+        if os.path.isdir(path):
+            merges_path = os.path.join(path, "merges.txt")
+            path = os.path.join(path, "vocab.json")
+        if path.endswith(".json"):
+            merges_path = merges_path or os.path.join(os.path.dirname(path), "merges.txt")
+            pair_ranks, ids = _read_vocab_merges(path, merges_path)
+            return cls({}, pair_ranks=pair_ranks, ids=ids, cache_size=cache_size)
+        return cls(_read_tiktoken(path), cache_size=cache_size)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def encode(self, text: str) -> List[int]:
+        out: List[int] = []
+        for piece in _PRETOKENIZE.findall(text or ""):
+            out.extend(self._piece_ids(piece))
+        return out
+
+    def decode(self, ids: Sequence[int]) -> str:
+        return b"".join(self._decoder.get(i, b"") for i in ids).decode("utf-8", "ignore")
+
+    def count(self, text: str) -> int:
+        return sum(len(self._piece_ids(piece)) for piece in _PRETOKENIZE.findall(text or ""))
+
+    def count_many(self, texts: Iterable[str]) -> List[int]:
+        return [self.count(t) for t in texts]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        ids = self.encode(text or "")
+        if len(ids) <= max_tokens:
+            return text or ""
+        return self.decode(ids[:max_tokens])
+
+    def cache_info(self) -> Tuple[int, int, int]:
+        info = self._encode_piece_cached.cache_info()
+        return info.hits, info.misses, info.currsize
+
+    def _piece_ids(self, piece: str) -> Tuple[int, ...]:
+        if len(piece) > _CACHE_MAX_PIECE:
+            return self._encode_piece(piece)
+        return self._encode_piece_cached(piece)
+
+    def _encode_piece(self, piece: str) -> Tuple[int, ...]:
+        data = piece.encode("utf-8")
+        if self._pair_ranks is None:
+            idx = self._ids.get(data)
+            if idx is not None:
+                return (idx,)
+        n = len(data)
+        parts: List[Optional[bytes]] = [data[i : i + 1] for i in range(n)]
+        nxt = list(range(1, n + 1))
+        prv = list(range(-1, n - 1))
+        heap: List[Tuple[int, int, bytes, bytes]] = []
+        for i in range(n - 1):
+            r = self._rank(parts[i], parts[i + 1])
+            if r is not None:
+                heap.append((r, i, parts[i], parts[i + 1]))
+        heapq.heapify(heap)
+        while heap:
+            _, i, left, right = heapq.heappop(heap)
+            j = nxt[i]
+            if parts[i] != left or j >= n or parts[j] != right:
+                continue
+            merged = left + right
+            parts[i] = merged
+            parts[j] = None
+            nxt[i] = nxt[j]
+            if nxt[i] < n:
+                prv[nxt[i]] = i
+                r = self._rank(merged, parts[nxt[i]])
+                if r is not None:
+                    heapq.heappush(heap, (r, i, merged, parts[nxt[i]]))
+            if prv[i] >= 0:
+                r = self._rank(parts[prv[i]], merged)
+                if r is not None:
+                    heapq.heappush(heap, (r, prv[i], parts[prv[i]], merged))
+        return tuple(self._ids.get(p, self._missing) for p in parts if p is not None)
+
+    def _rank(self, left: bytes, right: bytes) -> Optional[int]:
+        if self._pair_ranks is not None:
+            return self._pair_ranks.get((left, right))
+        return self._ranks.get(left + right)
+
+
+def load_tokenizer(path: str, *, cache_size: int = 65536) -> Optional[BPETokenizer]:
+    path = (path or "").strip()
+    if not path:
+        return None
+    try:
+        return BPETokenizer.from_files(path, cache_size=cache_size)
+    except (OSError, ValueError, KeyError, TypeError, UnicodeDecodeError):
+        return None
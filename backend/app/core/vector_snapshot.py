@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+SNAPSHOT_VERSION = 1
+
+_MANIFEST = "manifest.json"
+
+
+@dataclass(frozen=True)
+class VectorSnapshot:
+    data: np.ndarray
+    scales: np.ndarray
+    keys: np.ndarray
+    ids: List[str]
+    post_rows: np.ndarray
+    post_bounds: np.ndarray
+    fmt: str
+    dim: int
+    max_rowid: int
+    generation: int
+
+
+def _encode_ids(ids: List[str]) -> np.ndarray:
+    if any("\x00" in cid for cid in ids):
+        raise ValueError("chunk id contains NUL")
+    return np.frombuffer("\x00".join(ids).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_ids(blob: np.ndarray, count: int) -> List[str]:
+    if count == 0:
+        return []
+    return bytes(blob).decode("utf-8").split("\x00")
+
+
+def read_manifest(base_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(base_dir, _MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def save_snapshot(base_dir: str, snap: VectorSnapshot) -> str:
+    os.makedirs(base_dir, exist_ok=True)
+    token = uuid.uuid4().hex[:12]
+    path = os.path.join(base_dir, token)
+    os.makedirs(path)
+    try:
+        np.save(os.path.join(path, "emb.npy"), snap.data)
+        np.save(os.path.join(path, "scales.npy"), np.asarray(snap.scales, dtype=np.float32))
+        np.save(os.path.join(path, "keys.npy"), np.asarray(snap.keys, dtype=np.int64))
+        np.save(os.path.join(path, "ids.npy"), _encode_ids(snap.ids))
+        np.save(os.path.join(path, "post_rows.npy"), np.asarray(snap.post_rows, dtype=np.int64))
+        np.save(os.path.join(path, "post_bounds.npy"), np.asarray(snap.post_bounds, dtype=np.int64))
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "dir": token,
+            "fmt": snap.fmt,
+            "dim": int(snap.dim),
+            "count": len(snap.ids),
+            "max_rowid": int(snap.max_rowid),
+            "generation": int(snap.generation),
+            "created_at": int(time.time()),
+        }
+        tmp = os.path.join(base_dir, _MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(base_dir, _MANIFEST))
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    _prune(base_dir, keep=token)
+    return path
+
+
+def _prune(base_dir: str, *, keep: str) -> None:
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        if name != keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_snapshot(base_dir: str, *, mmap_mode: Optional[str] = "c") -> Optional[VectorSnapshot]:
+    manifest = read_manifest(base_dir)
+    if manifest is None:
+        return None
+    path = os.path.join(base_dir, str(manifest.get("dir", "")))
+    try:
+        count = int(manifest["count"])
+        dim = int(manifest["dim"])
+        data = np.load(os.path.join(path, "emb.npy"), mmap_mode=mmap_mode)
+        scales = np.load(os.path.join(path, "scales.npy"), mmap_mode=mmap_mode)
+        keys = np.load(os.path.join(path, "keys.npy"), mmap_mode=mmap_mode)
+        ids = _decode_ids(np.load(os.path.join(path, "ids.npy")), count)
+        post_rows = np.load(os.path.join(path, "post_rows.npy"), mmap_mode="r")
+        post_bounds = np.load(os.path.join(path, "post_bounds.npy"))
+        snap = VectorSnapshot(
+            data=data,
+            scales=scales,
+            keys=keys,
+            ids=ids,
+            post_rows=post_rows,
+            post_bounds=post_bounds,
+            fmt=str(manifest["fmt"]),
+            dim=dim,
+            max_rowid=int(manifest["max_rowid"]),
+            generation=int(manifest["generation"]),
+        )
+    except (OSError, KeyError, TypeError, ValueError, UnicodeDecodeError):
+        return None
+    if data.ndim != 2 or data.shape != (count, dim) or scales.shape != (count,) or keys.shape != (count,):
+        return None
+    if len(ids) != count or post_bounds.shape != (dim + 1,) or int(post_bounds[-1]) != post_rows.shape[0]:
+        return None
+    return snap
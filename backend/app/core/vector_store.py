@@ -1,16 +1,28 @@
 from __future__ import annotations
 
+import copy
+import functools
 import hashlib
+import heapq
+import itertools
 import json
 import math
 import os
 import re
 import sqlite3
 import struct
+import threading
 import time
-from dataclasses import dataclass
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
+
+from app.core.ann_index import IVFIndex
+from app.core.vector_snapshot import VectorSnapshot, load_snapshot, read_manifest, save_snapshot
+
 
 _TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[\u4e00-\u9fff]")
 
@@ -33,6 +45,302 @@ def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
         dot += x * y
     return dot / (na * nb)
 
+
+def _matches_filters(meta: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    if not filters:
+        return True
+    for fk, fv in filters.items():
+        if meta.get(fk) != fv:
+            return False
+    return True
+
+
+def _pool_size(k: int, candidate_pool: Optional[int]) -> int:
+    pool = int(candidate_pool or 0)
+    if pool <= 0:
+        pool = max(k * 4, 12)
+    return pool
+
+
+def _top_k_desc(scores: np.ndarray, k: int) -> np.ndarray:
+    n = int(scores.shape[0])
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    order = np.lexsort((idx, -scores[idx]))
+    return idx[order]
+
+
+_EMB_FORMATS = {"f32": 0, "f16": 1, "i8": 2}
+_EMB_DTYPES = {"f32": np.float32, "f16": np.float16, "i8": np.int8}
+_EMB_FORMAT_NAMES = {v: k for k, v in _EMB_FORMATS.items()}
+
+
+def _quantize_i8(v: np.ndarray) -> Tuple[np.ndarray, float]:
+    m = float(np.max(np.abs(v))) if v.size else 0.0
+    if m == 0.0:
+        return np.zeros(v.shape[0], dtype=np.int8), 1.0
+    scale = m / 127.0
+    q = np.rint(v / scale)
+    lost = (q == 0) & (v != 0)
+    q[lost] = np.sign(v[lost])
+    return q.astype(np.int8), scale
+
+
+def _encode_emb(vec: np.ndarray, fmt: str) -> bytes:
+    v = np.asarray(vec, dtype=np.float32)
+    if fmt == "f16":
+        return v.astype("<f2").tobytes()
+    if fmt == "i8":
+        q, scale = _quantize_i8(v)
+        return struct.pack("<f", scale) + q.tobytes()
+    return v.astype("<f4").tobytes()
+
+
+def _decode_emb(blob: Optional[bytes], fmt_code: Optional[int]) -> np.ndarray:
+    b = blob or b""
+    fmt = _EMB_FORMAT_NAMES.get(int(fmt_code or 0), "f32")
+    if fmt == "f16":
+        return np.frombuffer(b, dtype="<f2").astype(np.float32)
+    if fmt == "i8":
+        if len(b) < 4:
+            return np.zeros(0, dtype=np.float32)
+        scale = struct.unpack("<f", b[:4])[0]
+        return np.frombuffer(b[4:], dtype=np.int8).astype(np.float32) * np.float32(scale)
+    return np.frombuffer(b, dtype="<f4")
+
+
+class _EmbeddingMatrix:
+    def __init__(self, dim: int, *, capacity: int = 64, fmt: str = "f32") -> None:
+        if fmt not in _EMB_DTYPES:
+            raise ValueError(f"unknown embedding format: {fmt}")
+        self.dim = int(dim)
+        self.fmt = fmt
+        cap = max(1, int(capacity))
+        self._data = np.zeros((cap, self.dim), dtype=_EMB_DTYPES[fmt])
+        self._scales = np.ones(cap, dtype=np.float32)
+        self._keys = np.zeros(cap, dtype=np.int64)
+        self._n = 0
+        self._keys_sorted = True
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def nbytes(self) -> int:
+        n = self._n
+        extra = n * 4 if self.fmt == "i8" else 0
+        return int(n * self.dim * self._data.itemsize + extra + n * 8)
+
+    def normalize(self, vec: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32).reshape(-1)
+        if v.shape[0] != self.dim:
+            out = np.zeros(self.dim, dtype=np.float32)
+            m = min(self.dim, v.shape[0])
+            out[:m] = v[:m]
+            v = out
+        n = float(np.linalg.norm(v))
+        if n == 0.0:
+            return v
+        return v / n
+
+    def _store(self, pos: int, vec: Sequence[float]) -> None:
+        v = self.normalize(vec)
+        if self.fmt == "i8":
+            q, scale = _quantize_i8(v)
+            self._data[pos] = q
+            self._scales[pos] = scale
+        else:
+            self._data[pos] = v
+
+    def _grow(self, need: int) -> None:
+        cap = self._data.shape[0]
+        if need <= cap:
+            return
+        cap = max(1, cap)
+        while cap < need:
+            cap *= 2
+        data = np.zeros((cap, self.dim), dtype=self._data.dtype)
+        data[: self._n] = self._data[: self._n]
+        scales = np.ones(cap, dtype=np.float32)
+        scales[: self._n] = self._scales[: self._n]
+        keys = np.zeros(cap, dtype=np.int64)
+        keys[: self._n] = self._keys[: self._n]
+        self._data = data
+        self._scales = scales
+        self._keys = keys
+
+    def append(self, vec: Sequence[float], key: int = 0) -> int:
+        self._grow(self._n + 1)
+        pos = self._n
+        if pos > 0 and int(key) < int(self._keys[pos - 1]):
+            self._keys_sorted = False
+        self._store(pos, vec)
+        self._keys[pos] = int(key)
+        self._n += 1
+        return pos
+
+    def set(self, pos: int, vec: Sequence[float], key: Optional[int] = None) -> None:
+        self._store(pos, vec)
+        if key is not None and int(key) != int(self._keys[pos]):
+            self._keys[pos] = int(key)
+            self._keys_sorted = False
+
+    def load(self, data: np.ndarray, scales: np.ndarray, keys: np.ndarray) -> None:
+        self._data = data
+        self._scales = scales
+        self._keys = keys
+        self._n = int(data.shape[0])
+        self._keys_sorted = bool(np.all(np.diff(keys) >= 0))
+        self.dead = int(np.count_nonzero(keys < 0))
+
+    def view(self) -> np.ndarray:
+        return self._data[: self._n]
+
+    def scales(self) -> np.ndarray:
+        return self._scales[: self._n]
+
+    def dense(self, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        data = self._data[: self._n] if positions is None else self._data[positions]
+        if self.fmt == "f32":
+            return data
+        out = data.astype(np.float32)
+        if self.fmt == "i8":
+            out *= (self._scales[: self._n] if positions is None else self._scales[positions])[:, None]
+        return out
+
+    def row(self, pos: int) -> np.ndarray:
+        out = self._data[pos].astype(np.float32)
+        if self.fmt == "i8":
+            out *= self._scales[pos]
+        return out
+
+    def keys(self) -> np.ndarray:
+        return self._keys[: self._n]
+
+    def tombstone(self, positions: np.ndarray) -> None:
+        pos = np.asarray(positions, dtype=np.int64)
+        pos = pos[(pos >= 0) & (pos < self._n)]
+        if pos.size == 0:
+            return
+        self._data[pos] = 0
+        self._scales[pos] = 0.0
+        self._keys[pos] = -1
+        self._keys_sorted = False
+        self.dead += int(pos.size)
+
+    def compacted(self, alive: np.ndarray) -> "_EmbeddingMatrix":
+        keep = np.nonzero(alive[: self._n])[0]
+        out = _EmbeddingMatrix(self.dim, capacity=max(64, keep.size), fmt=self.fmt)
+        out._data[: keep.size] = self._data[keep]
+        out._scales[: keep.size] = self._scales[keep]
+        out._keys[: keep.size] = self._keys[keep]
+        out._n = int(keep.size)
+        out._keys_sorted = bool(np.all(np.diff(out._keys[: keep.size]) >= 0))
+        return out
+
+    def positions_for_keys(self, wanted: Sequence[int]) -> np.ndarray:
+        keys = self._keys[: self._n]
+        w = np.asarray(wanted, dtype=np.int64)
+        if w.size == 0 or self._n == 0:
+            return np.empty(0, dtype=np.int64)
+        if not self._keys_sorted:
+            return np.nonzero(np.isin(keys, w))[0]
+        idx = np.searchsorted(keys, w)
+        ok = idx < self._n
+        idx, w = idx[ok], w[ok]
+        return np.unique(idx[keys[idx] == w])
+
+    def scores(
+        self,
+        q: np.ndarray,
+        positions: Optional[np.ndarray] = None,
+        *,
+        n: Optional[int] = None,
+        block: int = 65536,
+    ) -> np.ndarray:
+        data = self._data
+        scales = self._scales
+        n = self._n if n is None else min(int(n), self._n)
+        if self.fmt == "f32":
+            mat = data[:n] if positions is None else data[positions]
+            return mat @ q
+        total = n if positions is None else int(positions.shape[0])
+        out = np.empty(total, dtype=np.float32)
+        for i in range(0, total, block):
+            idx = slice(i, min(total, i + block)) if positions is None else positions[i : i + block]
+            out[i : i + block] = data[idx].astype(np.float32) @ q
+        if self.fmt == "i8":
+            out *= scales[:n] if positions is None else scales[positions]
+        return out
+
+
+_PRUNE_MAX_FRACTION = 0.5
+_COMPACT_MIN_FRACTION = 0.05
+
+
+class _BucketPostings:
+    def __init__(self, dim: int) -> None:
+        self.dim = int(dim)
+        empty = np.empty(0, dtype=np.int64)
+        self._base: List[np.ndarray] = [empty] * self.dim
+        self._lists: List[List[int]] = [[] for _ in range(self.dim)]
+        self._cache: List[Optional[np.ndarray]] = [empty] * self.dim
+        self._lock = threading.Lock()
+
+    def build(self, mat: np.ndarray) -> None:
+        rows, cols = np.nonzero(mat)
+        order = np.argsort(cols, kind="stable")
+        counts = np.bincount(cols, minlength=self.dim)
+        self.load(rows[order].astype(np.int64), np.concatenate(([0], np.cumsum(counts))))
+
+    def load(self, rows: np.ndarray, bounds: np.ndarray) -> None:
+        base = [rows[int(bounds[b]) : int(bounds[b + 1])] for b in range(self.dim)]
+        with self._lock:
+            self._base = base
+            self._lists = [[] for _ in range(self.dim)]
+            self._cache = list(base)
+
+    def add(self, pos: int, row: np.ndarray) -> None:
+        with self._lock:
+            for b in np.nonzero(row)[0]:
+                self._lists[b].append(int(pos))
+                self._cache[b] = None
+
+    def _array(self, b: int) -> np.ndarray:
+        arr = self._cache[b]
+        if arr is None:
+            arr = np.concatenate((self._base[b], np.asarray(self._lists[b], dtype=np.int64)))
+            self._cache[b] = arr
+        return arr
+
+    def csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            parts = [self._array(b) for b in range(self.dim)]
+        bounds = np.concatenate(([0], np.cumsum([p.shape[0] for p in parts]))).astype(np.int64)
+        return np.concatenate(parts).astype(np.int64), bounds
+
+    def candidates(self, buckets: np.ndarray) -> np.ndarray:
+        with self._lock:
+            parts = [self._array(int(b)) for b in buckets]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
+
+
+def _restrict(positions: Optional[np.ndarray], cand: np.ndarray) -> np.ndarray:
+    if positions is None:
+        return cand
+    return np.intersect1d(positions, cand, assume_unique=True)
+
+
+_MMR_TIE_EPS = 1e-12
+
+
 def _mmr_select(
     candidates: List[Tuple[float, "MemoryChunk"]],
     *,
@@ -44,32 +352,84 @@ def _mmr_select(
     lam = float(lambda_mult)
     lam = max(0.0, min(1.0, lam))
 
-    selected: List[MemoryChunk] = []
-    selected_embs: List[Tuple[float, ...]] = []
+    n = len(candidates)
+    sim_q = np.fromiter((float(s) for s, _ in candidates), dtype=np.float64, count=n)
+    dim = max(len(ch.embedding) for _, ch in candidates)
+    emb = np.zeros((n, max(1, dim)), dtype=np.float64)
+    for i, (_, ch) in enumerate(candidates):
+        if ch.embedding:
+            emb[i, : len(ch.embedding)] = ch.embedding
+    norms = np.linalg.norm(emb, axis=1)
+    norms[norms == 0.0] = 1.0
+    pair_sim = (emb @ emb.T) / np.outer(norms, norms)
 
-    while candidates and len(selected) < k:
-        best_idx = -1
-        best_score = -1e9
-        for i, (sim_q, ch) in enumerate(candidates):
-            if not selected_embs:
-                score = sim_q
-            else:
-                max_sim = 0.0
-                for emb in selected_embs:
-                    s = _cosine(emb, ch.embedding)
-                    if s > max_sim:
-                        max_sim = s
-                score = lam * sim_q - (1.0 - lam) * max_sim
-            if score > best_score:
-                best_score = score
-                best_idx = i
-        if best_idx < 0:
-            break
-        _, picked = candidates.pop(best_idx)
-        selected.append(picked)
-        selected_embs.append(picked.embedding)
+    max_sim = np.zeros(n, dtype=np.float64)
+    taken = np.zeros(n, dtype=bool)
+    order: List[int] = []
+    score = sim_q.copy()
+    while len(order) < min(k, n):
+        if order:
+            score = lam * sim_q - (1.0 - lam) * max_sim
+        score[taken] = -np.inf
+        best = float(score[int(np.argmax(score))])
+        idx = int(np.flatnonzero(score >= best - _MMR_TIE_EPS)[0])
+        order.append(idx)
+        taken[idx] = True
+        np.maximum(max_sim, pair_sim[idx], out=max_sim)
+
+    return [candidates[i][1] for i in order]
+
+
+def _select(pool_scored: List[Tuple[float, "MemoryChunk"]], k: int, mmr_lambda: float) -> List["MemoryChunk"]:
+    if mmr_lambda and mmr_lambda > 0.0:
+        return _mmr_select(pool_scored, k=k, lambda_mult=mmr_lambda)
+    return [c for s, c in pool_scored[:k]]
+
+
+def _score_chunks(q: Sequence[float], chunks: List["MemoryChunk"]) -> List[Tuple[float, "MemoryChunk"]]:
+    return [(_cosine(q, ch.embedding), ch) for ch in chunks]
+
+
+def merge_scored(
+    pools: Iterable[List[Tuple[float, "MemoryChunk"]]],
+    k: int,
+    *,
+    mmr_lambda: float = 0.0,
+    candidate_pool: Optional[int] = None,
+) -> List["MemoryChunk"]:
+    merged = sorted(itertools.chain.from_iterable(pools), key=lambda t: t[0], reverse=True)
+    return _select(merged[: _pool_size(k, candidate_pool)], k, mmr_lambda)
+
+
+@functools.lru_cache(maxsize=65536)
+def _token_hash(tok: str) -> Tuple[int, float]:
+    h = hashlib.md5(tok.encode("utf-8")).digest()
+    return int.from_bytes(h[:4], "little"), (-1.0 if (h[4] & 1) else 1.0)
 
-    return selected
+
+_SLOT_TABLES: Dict[int, Dict[str, int]] = {}
+_SLOT_TABLE_LOCK = threading.Lock()
+_SLOT_TABLE_MAX = 262144
+
+
+def _slot_code(tok: str, dim: int) -> int:
+    h, sign = _token_hash(tok)
+    return (h % dim) * 2 + (1 if sign < 0 else 0)
+
+
+def _slot_table(dim: int) -> Dict[str, int]:
+    table = _SLOT_TABLES.get(dim)
+    if table is None:
+        with _SLOT_TABLE_LOCK:
+            table = _SLOT_TABLES.get(dim)
+            if table is None:
+                table = {}
+                for cp in range(0x4E00, 0xA000):
+                    ch = chr(cp)
+                    h = hashlib.md5(ch.encode("utf-8")).digest()
+                    table[ch] = (int.from_bytes(h[:4], "little") % dim) * 2 + (h[4] & 1)
+                _SLOT_TABLES[dim] = table
+    return table
 
 
 class HashingEmbedder:
@@ -77,18 +437,45 @@ class HashingEmbedder:
         if dim <= 0:
             raise ValueError("dim must be positive")
         self.dim = dim
+        self._table = _slot_table(dim)
+
+    def _codes(self, text: str) -> List[int]:
+        table = self._table
+        toks = _tokenize(text)
+        codes = list(map(table.get, toks))
+        if None in codes:
+            for i, c in enumerate(codes):
+                if c is None:
+                    c = _slot_code(toks[i], self.dim)
+                    if len(table) < _SLOT_TABLE_MAX:
+                        table[toks[i]] = c
+                    codes[i] = c
+        return codes
+
+    def _counts(self, codes: np.ndarray, minlength: int) -> np.ndarray:
+        return np.bincount(codes >> 1, weights=1.0 - 2.0 * (codes & 1), minlength=minlength)
 
     def embed(self, text: str) -> List[float]:
-        vec = [0.0] * self.dim
-        for tok in _tokenize(text):
-            h = hashlib.md5(tok.encode("utf-8")).digest()
-            idx = int.from_bytes(h[:4], "little") % self.dim
-            sign = -1.0 if (h[4] & 1) else 1.0
-            vec[idx] += sign
-        n = _l2_norm(vec)
+        codes = self._codes(text)
+        if not codes:
+            return [0.0] * self.dim
+        counts = self._counts(np.asarray(codes, dtype=np.int64), self.dim)
+        n = math.sqrt(float(np.dot(counts, counts)))
         if n == 0.0:
-            return vec
-        return [v / n for v in vec]
+            return counts.tolist()
+        return (counts / n).tolist()
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        rows = len(texts)
+        parts: List[np.ndarray] = []
+        for r, text in enumerate(texts):
+            codes = np.asarray(self._codes(text), dtype=np.int64)
+            parts.append(codes + 2 * r * self.dim)
+        flat = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        counts = self._counts(flat, rows * self.dim).reshape(rows, self.dim)
+        norms = np.sqrt(np.sum(counts * counts, axis=1))
+        norms[norms == 0.0] = 1.0
+        return (counts / norms[:, None]).astype(np.float32)
 
 
 @dataclass(frozen=True)
@@ -99,14 +486,146 @@ class MemoryChunk:
     meta: Dict[str, Any]
 
 
+def _copy_scored(value: List[Tuple[float, MemoryChunk]]) -> List[Tuple[float, MemoryChunk]]:
+    return [(sc, replace(ch, meta=copy.deepcopy(ch.meta))) for sc, ch in value]
+
+
+def _query_key(
+    query: str,
+    k: int,
+    filters: Optional[Dict[str, Any]],
+    candidate_pool: Optional[int],
+    hybrid: bool,
+) -> Tuple[Any, ...]:
+    flt = json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str) if filters else ""
+    norm = " ".join((query or "").lower().split())
+    return (norm, int(k), flt, _pool_size(k, candidate_pool), bool(hybrid))
+
+
+class _QueryCache:
+    def __init__(self, capacity: int = 256) -> None:
+        self.capacity = max(0, int(capacity))
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Tuple[Any, ...], Tuple[int, List[Tuple[float, MemoryChunk]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Any, ...], generation: int) -> Optional[List[Tuple[float, MemoryChunk]]]:
+        if self.capacity == 0:
+            return None
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        return _copy_scored(value)
+
+    def put(self, key: Tuple[Any, ...], generation: int, value: List[Tuple[float, MemoryChunk]]) -> None:
+        if self.capacity == 0:
+            return
+        value = _copy_scored(value)
+        with self._lock:
+            self._items[key] = (generation, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "capacity": self.capacity}
+
+
+_ENTITY_CACHE_DEPTH = 32
+
+
+def _meta_entities(meta: Optional[Dict[str, Any]]) -> List[str]:
+    ents = (meta or {}).get("entities")
+    if not isinstance(ents, (list, tuple)):
+        return []
+    return list(dict.fromkeys(str(e) for e in ents if e))
+
+
+def _recent_unique(ids: List[str], limit: int) -> List[str]:
+    out: Dict[str, None] = {}
+    for cid in reversed(ids):
+        if len(out) >= limit:
+            break
+        out[cid] = None
+    return list(out)
+
+
+class _EntityCache:
+    def __init__(self, capacity: int = 1024) -> None:
+        self.capacity = max(0, int(capacity))
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, entity: str) -> Optional[List[str]]:
+        with self._lock:
+            ids = self._items.get(entity)
+            if ids is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(entity)
+            self.hits += 1
+            return ids
+
+    def put(self, entity: str, generation: int, ids: List[str]) -> None:
+        if self.capacity == 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._items[entity] = ids
+            self._items.move_to_end(entity)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def discard(self, entities: Iterable[str]) -> None:
+        with self._lock:
+            self.generation += 1
+            for e in entities:
+                self._items.pop(e, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._items.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "capacity": self.capacity}
+
+
 class InMemoryVectorStore:
     def __init__(self, embedder: Optional[HashingEmbedder] = None) -> None:
         self._embedder = embedder or HashingEmbedder()
         self._chunks: List[MemoryChunk] = []
+        self._entities: Dict[str, List[str]] = {}
 
     def add(self, chunk_id: str, text: str, meta: Optional[Dict[str, Any]] = None) -> None:
         emb = tuple(self._embedder.embed(text))
         self._chunks.append(MemoryChunk(id=chunk_id, text=text, embedding=emb, meta=meta or {}))
+        for e in _meta_entities(meta):
+            self._entities.setdefault(e, []).append(chunk_id)
+
+    def entity_chunk_ids(self, entities: Sequence[str], limit: int = 4) -> Dict[str, List[str]]:
+        return {e: _recent_unique(self._entities.get(e, []), limit) for e in dict.fromkeys(entities)}
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[str]:
+        ids: List[str] = []
+        for chunk_id, text, meta in items:
+            self.add(chunk_id, text, meta=meta)
+            ids.append(chunk_id)
+        return ids
 
     def search(
         self,
@@ -116,52 +635,582 @@ class InMemoryVectorStore:
         *,
         mmr_lambda: float = 0.0,
         candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
     ) -> List[MemoryChunk]:
+        if k <= 0 or not self._chunks:
+            return []
+        return _select(self.search_scored(query, k, filters, candidate_pool=candidate_pool), k, mmr_lambda)
+
+    def search_scored(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        *,
+        candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
+    ) -> List[Tuple[float, MemoryChunk]]:
         if k <= 0 or not self._chunks:
             return []
         q = tuple(self._embedder.embed(query))
 
         scored: List[Tuple[float, MemoryChunk]] = []
         for ch in self._chunks:
-            if filters:
-                ok = True
-                for fk, fv in filters.items():
-                    if ch.meta.get(fk) != fv:
-                        ok = False
-                        break
-                if not ok:
-                    continue
+            if not _matches_filters(ch.meta, filters):
+                continue
             scored.append((_cosine(q, ch.embedding), ch))
 
         scored.sort(key=lambda t: t[0], reverse=True)
-        pool = int(candidate_pool or 0)
-        if pool <= 0:
-            pool = max(k * 4, 12)
-        pool_scored = [(s, c) for s, c in scored[:pool] if s > 0.0]
-        if mmr_lambda and mmr_lambda > 0.0:
-            return _mmr_select(pool_scored, k=k, lambda_mult=mmr_lambda)
-        return [c for s, c in pool_scored[:k]]
+        pool = _pool_size(k, candidate_pool)
+        return [(s, c) for s, c in scored[:pool] if s > 0.0]
+
+    def score_ids(self, query: str, ids: Sequence[str]) -> List[Tuple[float, MemoryChunk]]:
+        wanted = set(ids)
+        by_id = {ch.id: ch for ch in self._chunks if ch.id in wanted}
+        return _score_chunks(self._embedder.embed(query), [by_id[cid] for cid in dict.fromkeys(ids) if cid in by_id])
 
     def iter_chunks(self) -> Iterable[MemoryChunk]:
         return iter(self._chunks)
 
 
+class NumpyVectorStore:
+    def __init__(self, embedder: Optional[HashingEmbedder] = None, *, query_cache_size: int = 256) -> None:
+        self._embedder = embedder or HashingEmbedder()
+        self._chunks: List[MemoryChunk] = []
+        self._matrix = _EmbeddingMatrix(self._embedder.dim)
+        self._postings = _BucketPostings(self._embedder.dim)
+        self._pos_by_id: Dict[str, int] = {}
+        self._entities: Dict[str, List[str]] = {}
+        self._generation = 0
+        self._cache = _QueryCache(query_cache_size)
+
+    def add(self, chunk_id: str, text: str, meta: Optional[Dict[str, Any]] = None) -> None:
+        self._generation += 1
+        emb = tuple(self._embedder.embed(text))
+        self._chunks.append(MemoryChunk(id=chunk_id, text=text, embedding=emb, meta=meta or {}))
+        pos = self._matrix.append(emb)
+        self._postings.add(pos, self._matrix.row(pos))
+        self._pos_by_id[chunk_id] = pos
+        for e in _meta_entities(meta):
+            self._entities.setdefault(e, []).append(chunk_id)
+
+    def entity_chunk_ids(self, entities: Sequence[str], limit: int = 4) -> Dict[str, List[str]]:
+        return {e: _recent_unique(self._entities.get(e, []), limit) for e in dict.fromkeys(entities)}
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[str]:
+        ids: List[str] = []
+        for chunk_id, text, meta in items:
+            self.add(chunk_id, text, meta=meta)
+            ids.append(chunk_id)
+        return ids
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        *,
+        mmr_lambda: float = 0.0,
+        candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
+    ) -> List[MemoryChunk]:
+        if k <= 0 or not self._chunks:
+            return []
+        return _select(self.search_scored(query, k, filters, candidate_pool=candidate_pool, hybrid=hybrid), k, mmr_lambda)
+
+    def search_scored(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        *,
+        candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
+    ) -> List[Tuple[float, MemoryChunk]]:
+        if k <= 0 or not self._chunks:
+            return []
+        key = _query_key(query, k, filters, candidate_pool, hybrid)
+        generation = self._generation
+        pool_scored = self._cache.get(key, generation)
+        if pool_scored is None:
+            pool_scored = self._search(query, k, filters, candidate_pool=candidate_pool)
+            self._cache.put(key, generation, pool_scored)
+        return pool_scored
+
+    def score_ids(self, query: str, ids: Sequence[str]) -> List[Tuple[float, MemoryChunk]]:
+        chunks = [self._chunks[self._pos_by_id[cid]] for cid in dict.fromkeys(ids) if cid in self._pos_by_id]
+        return _score_chunks(self._embedder.embed(query), chunks)
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+    def _search(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        *,
+        candidate_pool: Optional[int],
+    ) -> List[Tuple[float, MemoryChunk]]:
+        q = self._matrix.normalize(self._embedder.embed(query))
+        buckets = np.nonzero(q)[0]
+        if buckets.size == 0:
+            return []
+
+        positions: Optional[np.ndarray] = None
+        if filters:
+            positions = np.fromiter(
+                (i for i, ch in enumerate(self._chunks) if _matches_filters(ch.meta, filters)),
+                dtype=np.int64,
+            )
+        cand = self._postings.candidates(buckets)
+        if cand.size < len(self._chunks) * _PRUNE_MAX_FRACTION:
+            positions = _restrict(positions, cand)
+        if positions is not None and positions.size == 0:
+            return []
+        scores = self._matrix.scores(q, positions)
+        top = _top_k_desc(scores, _pool_size(k, candidate_pool))
+
+        pool_scored: List[Tuple[float, MemoryChunk]] = []
+        for i in top:
+            s = float(scores[i])
+            if s <= 0.0:
+                break
+            pos = int(positions[i]) if positions is not None else int(i)
+            pool_scored.append((s, self._chunks[pos]))
+        return pool_scored
+
+    def iter_chunks(self) -> Iterable[MemoryChunk]:
+        return iter(self._chunks)
+
+
+_HOT_META_KEYS = ("source", "filename", "file_id", "kind")
+
+
+def _is_hot_scalar(v: Any) -> bool:
+    return isinstance(v, (str, int, float)) and not isinstance(v, bool)
+
+
+def _hot_meta_value(meta: Dict[str, Any], key: str) -> Any:
+    v = meta.get(key)
+    return v if _is_hot_scalar(v) else None
+
+
+def _split_filters(filters: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    hot: Dict[str, Any] = {}
+    cold: Dict[str, Any] = {}
+    for fk, fv in (filters or {}).items():
+        if fk in _HOT_META_KEYS and _is_hot_scalar(fv):
+            hot[fk] = fv
+        else:
+            cold[fk] = fv
+    return hot, cold
+
+
+_FTS_TERM_RE = re.compile(r"[A-Za-z0-9_]+|[\u4e00-\u9fff]+")
+_FTS_MIN_TERM = 2
+_LEXICAL_POOL_MULT = 8
+_LEXICAL_MAX_MATCH_MULT = 4
+_LEXICAL_BONUS = 1.0
+
+
+def _lex_tokens(t: str) -> List[str]:
+    if t.isascii() or len(t) < 2:
+        return [t]
+    return [t[i : i + 2] for i in range(len(t) - 1)]
+
+
+def _lex_body(text: str) -> str:
+    return " ".join(tok for m in _FTS_TERM_RE.finditer(text) for tok in _lex_tokens(m.group(0).lower()))
+
+
+def _lex_match(query: str) -> str:
+    phrases: List[str] = []
+    for m in _FTS_TERM_RE.finditer(query):
+        t = m.group(0).lower()
+        if len(t) < _FTS_MIN_TERM:
+            continue
+        phrase = '"' + " ".join(_lex_tokens(t)) + '"'
+        phrases.append(phrase + "*" if t.isascii() else phrase)
+    return " AND ".join(dict.fromkeys(phrases))
+
+
+_SIMHASH_BANDS = 4
+_SIMHASH_BAND_BITS = 64 // _SIMHASH_BANDS
+_DEDUP_MODES = ("off", "skip", "merge")
+
+
+@functools.lru_cache(maxsize=65536)
+def _shingle_hash64(shingle: str) -> int:
+    return int.from_bytes(hashlib.md5(shingle.encode("utf-8")).digest()[:8], "little")
+
+
+def _simhash64(text: str) -> int:
+    toks = _tokenize(text)
+    if not toks:
+        return 0
+    shingles = toks if len(toks) == 1 else [f"{a}\x1f{b}" for a, b in zip(toks, toks[1:])]
+    counts: Dict[str, int] = {}
+    for sh in shingles:
+        counts[sh] = counts.get(sh, 0) + 1
+    hashes = np.asarray([_shingle_hash64(sh) for sh in counts], dtype="<u8")
+    weights = np.asarray(list(counts.values()), dtype=np.float64)
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    acc = weights @ (bits.astype(np.float64) * 2.0 - 1.0)
+    return int(np.packbits(acc > 0.0, bitorder="little").view("<u8")[0])
+
+
+def _simhash_bands(h: int) -> Tuple[int, ...]:
+    mask = (1 << _SIMHASH_BAND_BITS) - 1
+    return tuple((h >> (_SIMHASH_BAND_BITS * i)) & mask for i in range(_SIMHASH_BANDS))
+
+
+def _signed64(h: int) -> int:
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def _hamming64(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def _merge_meta(base: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(base)
+    for key, value in extra.items():
+        cur = out.get(key)
+        if key not in out or cur is None or (key in _HOT_META_KEYS and _is_hot_scalar(value)):
+            out[key] = value
+        elif isinstance(cur, list) and isinstance(value, list):
+            out[key] = cur + [v for v in value if v not in cur]
+    return out
+
+
+def _decode_meta(meta_json: Optional[str]) -> Dict[str, Any]:
+    try:
+        return json.loads(meta_json) if meta_json else {}
+    except Exception:
+        return {}
+
+
+class _ConnectionPool:
+    def __init__(
+        self,
+        db_path: str,
+        *,
+        mmap_size: int = 0,
+        cache_size: int = -2000,
+        cached_statements: int = 128,
+    ) -> None:
+        self._db_path = db_path
+        self._mmap_size = int(mmap_size)
+        self._cache_size = int(cache_size)
+        self._cached_statements = max(0, int(cached_statements))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._holders: "weakref.WeakSet[_PooledConnection]" = weakref.WeakSet()
+        self._closed = False
+
+    def get(self) -> sqlite3.Connection:
+        holder = getattr(self._local, "holder", None)
+        if holder is not None and not self._closed:
+            return holder.conn
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        conn = sqlite3.connect(self._db_path, check_same_thread=False, cached_statements=self._cached_statements)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute(f"PRAGMA mmap_size={self._mmap_size};")
+        conn.execute(f"PRAGMA cache_size={self._cache_size};")
+        conn.execute("PRAGMA recursive_triggers=ON;")
+        holder = _PooledConnection(conn)
+        with self._lock:
+            if self._closed:
+                holder.close()
+                raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+            self._holders.add(holder)
+        self._local.holder = holder
+        return conn
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._holders)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            holders = list(self._holders)
+            self._holders.clear()
+        for holder in holders:
+            holder.close()
+
+
+def _close_quietly(conn: sqlite3.Connection) -> None:
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+class _PooledConnection:
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self._finalizer = weakref.finalize(self, _close_quietly, conn)
+
+    def close(self) -> None:
+        self._finalizer()
+
+
 class PersistentVectorStore:
-    def __init__(self, *, db_path: str, embedder: Optional[HashingEmbedder] = None) -> None:
+    def __init__(
+        self,
+        *,
+        db_path: str,
+        embedder: Optional[HashingEmbedder] = None,
+        resident_cache: bool = True,
+        mmap_size: int = 268435456,
+        cache_size: int = -65536,
+        ann_min_chunks: int = 0,
+        ann_nlist: int = 0,
+        ann_nprobe: int = 0,
+        emb_format: str = "f32",
+        fts: bool = True,
+        query_cache_size: int = 256,
+        dedup: str = "off",
+        dedup_max_distance: int = 3,
+        snapshot: bool = False,
+        entity_cache_size: int = 1024,
+    ) -> None:
+        if emb_format not in _EMB_FORMATS:
+            raise ValueError(f"unknown embedding format: {emb_format}")
+        if dedup not in _DEDUP_MODES:
+            raise ValueError(f"unknown dedup mode: {dedup}")
+        self._dedup = dedup
+        self._dedup_max_distance = max(0, int(dedup_max_distance))
+        self._dedup_counts = {"checked": 0, "skipped": 0, "merged": 0}
         self._embedder = embedder or HashingEmbedder()
+        self._emb_format = emb_format
         self._db_path = os.path.abspath(db_path)
         os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+        self._pool = _ConnectionPool(self._db_path, mmap_size=mmap_size, cache_size=cache_size)
         self._init_db()
+        self._fts = bool(fts) and self._init_fts()
+        self._lex_sync = self._fts or self._has_lex_table()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._generation = 0
+        self._cache = _QueryCache(query_cache_size)
+        self._entity_cache = _EntityCache(entity_cache_size)
+        self._touched: Dict[str, int] = {}
+        self._matrix: Optional[_EmbeddingMatrix] = None
+        self._postings: Optional[_BucketPostings] = None
+        self._pos_by_id: Dict[str, int] = {}
+        self._ann_min_chunks = max(0, int(ann_min_chunks))
+        self._ann_nlist = max(0, int(ann_nlist))
+        self._ann_nprobe = max(0, int(ann_nprobe))
+        self._ann_path = self._db_path + ".ivf.npz"
+        self._ann_lock = threading.Lock()
+        self._ann: Optional[IVFIndex] = None
+        self._snapshot = bool(snapshot)
+        self._snapshot_dir = self._db_path + ".snapshot"
+        self._snapshot_generation = -1
+        if resident_cache:
+            self._load_mirror()
+            self._load_ann()
 
     def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self._db_path)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        return conn
+        return self._pool.get()
 
-    def _init_db(self) -> None:
+    def close(self) -> None:
+        with self._write_lock:
+            self._flush_touched()
+            self._save_ann()
+            if self._snapshot and self._snapshot_generation != self._generation:
+                self._save_snapshot()
+            self._pool.close()
+
+    def count(self, source: Optional[str] = None) -> int:
+        conn = self._connect()
+        if source is None:
+            return int(conn.execute("SELECT count(*) FROM chunks").fetchone()[0])
+        return int(conn.execute("SELECT count(*) FROM chunks WHERE source=?", (source,)).fetchone()[0])
+
+    def maintain(
+        self,
+        *,
+        max_chunks: int = 0,
+        max_age_s: float = 0.0,
+        source_quotas: Optional[Dict[str, int]] = None,
+        batch_size: int = 1000,
+        vacuum_pages: int = 4096,
+    ) -> Dict[str, int]:
+        self._flush_touched()
+        batch = max(1, int(batch_size))
+        deleted = 0
+        if max_age_s and max_age_s > 0:
+            cutoff = int(time.time() - float(max_age_s))
+            deleted += self._evict_where("created_at < ?", [cutoff], None, batch)
+        for source, quota in (source_quotas or {}).items():
+            excess = self.count(source) - max(0, int(quota))
+            if excess > 0:
+                deleted += self._evict_where("source = ?", [source], excess, batch)
+        if max_chunks and max_chunks > 0:
+            excess = self.count() - int(max_chunks)
+            if excess > 0:
+                deleted += self._evict_where("", [], excess, batch)
+        self._compact_resident()
+        vacuumed = self._reclaim(vacuum_pages)
+        snapshot = 0
+        if self._snapshot:
+            with self._write_lock:
+                if self._snapshot_generation != self._generation:
+                    snapshot = int(self._save_snapshot() is not None)
+        return {"deleted": deleted, "vacuumed_pages": vacuumed, "chunks": self.count(), "snapshot": snapshot}
+
+    def _flush_touched(self) -> None:
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE chunks SET last_retrieved_at=? WHERE id=? AND last_retrieved_at<?",
+                [(ts, cid, ts) for cid, ts in touched.items()],
+            )
+
+    def _evict_where(self, cond: str, params: List[Any], limit: Optional[int], batch: int) -> int:
+        where = f" WHERE {cond}" if cond else ""
+        removed = 0
+        while limit is None or removed < limit:
+            take = batch if limit is None else min(batch, limit - removed)
+            with self._write_lock:
+                conn = self._connect()
+                rows = conn.execute(
+                    f"SELECT rowid,id FROM chunks{where} ORDER BY last_retrieved_at, rowid LIMIT ?", params + [take]
+                ).fetchall()
+                if not rows:
+                    break
+                with conn:
+                    conn.executemany("DELETE FROM chunks WHERE rowid=?", [(int(r[0]),) for r in rows])
+                    self._bump_db_generation(conn)
+                self._tombstone([str(r[1]) for r in rows])
+            removed += len(rows)
+        return removed
+
+    def _tombstone(self, ids: Sequence[str]) -> None:
+        self._entity_cache.clear()
+        with self._lock:
+            self._generation += 1
+            for cid in ids:
+                self._touched.pop(cid, None)
+            if self._matrix is None:
+                return
+            dead = [self._pos_by_id.pop(cid) for cid in ids if cid in self._pos_by_id]
+            self._matrix.tombstone(np.asarray(dead, dtype=np.int64))
+
+    def _compact_resident(self) -> None:
+        with self._write_lock, self._ann_lock:
+            matrix = self._matrix
+            if matrix is None or matrix.dead == 0:
+                return
+            if matrix.dead < len(matrix) * _COMPACT_MIN_FRACTION:
+                return
+            alive = matrix.keys() >= 0
+            compacted = matrix.compacted(alive)
+            remap = np.cumsum(alive) - 1
+            pos_by_id = {cid: int(remap[pos]) for cid, pos in self._pos_by_id.items()}
+            postings = _BucketPostings(self._embedder.dim)
+            dense = compacted.dense()
+            postings.build(dense)
+            ann = self._ann.compacted(alive, dense) if self._ann is not None else None
+            with self._lock:
+                self._matrix = compacted
+                self._postings = postings
+                self._pos_by_id = pos_by_id
+                self._ann = ann
+                self._generation += 1
+
+    def _reclaim(self, vacuum_pages: int) -> int:
         conn = self._connect()
+        freed = 0
+        if vacuum_pages > 0 and int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) == 2:
+            before = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+            conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+            freed = before - int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        return freed
+
+    def _load_ann(self) -> None:
+        if self._matrix is None or self._ann_min_chunks <= 0 or not os.path.exists(self._ann_path):
+            return
+        with self._lock:
+            mat = self._matrix.dense()
+            keys = self._matrix.keys()
+        if mat.shape[0] < self._ann_min_chunks:
+            return
+        ann = IVFIndex(self._embedder.dim, nlist=self._ann_nlist, nprobe=self._ann_nprobe)
+        if ann.load(self._ann_path, keys, mat):
+            self._install_ann(ann, mat.shape[0])
+
+    def _save_ann(self) -> None:
+        ann = self._ann
+        if ann is None or self._matrix is None:
+            return
+        with self._lock:
+            keys = self._matrix.keys().copy()
         try:
+            ann.save(self._ann_path, keys)
+        except OSError:
+            pass
+
+    def _install_ann(self, ann: IVFIndex, indexed: int) -> None:
+        with self._lock:
+            if self._matrix is None:
+                return
+            for pos in range(indexed, len(self._matrix)):
+                ann.add(pos, self._matrix.row(pos))
+            self._ann = ann
+
+    def _ensure_ann(self, n: int) -> Optional[IVFIndex]:
+        if self._ann_min_chunks <= 0 or n < self._ann_min_chunks:
+            return None
+        ann = self._ann
+        if (ann is None or n > 2 * ann.trained_size) and self._ann_lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=self._train_ann_async, name="streamvis-ann-train", daemon=True).start()
+            except RuntimeError:
+                self._ann_lock.release()
+        return ann
+
+    def _train_ann_async(self) -> None:
+        try:
+            self._train_ann()
+        finally:
+            self._ann_lock.release()
+
+    def build_ann_index(self) -> Optional[IVFIndex]:
+        with self._ann_lock:
+            return self._train_ann()
+
+    def _train_ann(self) -> Optional[IVFIndex]:
+        if self._matrix is None:
+            return None
+        with self._lock:
+            mat = self._matrix.dense()
+        if mat.shape[0] == 0:
+            return None
+        ann = self._ann
+        if ann is not None and mat.shape[0] <= 2 * ann.trained_size:
+            return ann
+        fresh = IVFIndex(self._embedder.dim, nlist=self._ann_nlist, nprobe=self._ann_nprobe)
+        fresh.train(mat)
+        self._install_ann(fresh, mat.shape[0])
+        self._save_ann()
+        return self._ann
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        with conn:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS chunks (
@@ -169,36 +1218,601 @@ class PersistentVectorStore:
                   text TEXT NOT NULL,
                   emb BLOB NOT NULL,
                   meta TEXT NOT NULL,
-                  created_at INTEGER NOT NULL
+                  created_at INTEGER NOT NULL,
+                  source,
+                  filename,
+                  file_id,
+                  kind,
+                  emb_fmt INTEGER NOT NULL DEFAULT 0,
+                  last_retrieved_at INTEGER NOT NULL DEFAULT 0,
+                  simhash INTEGER,
+                  sh_b0 INTEGER,
+                  sh_b1 INTEGER,
+                  sh_b2 INTEGER,
+                  sh_b3 INTEGER
                 );
                 """
             )
             conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_created ON chunks(created_at);")
-            conn.commit()
-        finally:
-            conn.close()
+            conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_buckets (
+                  bucket INTEGER NOT NULL,
+                  chunk_rowid INTEGER NOT NULL,
+                  PRIMARY KEY (bucket, chunk_rowid)
+                ) WITHOUT ROWID;
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_buckets_rowid ON chunk_buckets(chunk_rowid);")
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_chunks_buckets_del AFTER DELETE ON chunks BEGIN
+                  DELETE FROM chunk_buckets WHERE chunk_rowid = old.rowid;
+                END;
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_entities (
+                  entity TEXT NOT NULL,
+                  chunk_id TEXT NOT NULL,
+                  created_at INTEGER NOT NULL,
+                  PRIMARY KEY (entity, chunk_id)
+                );
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunk_entities_recent ON chunk_entities(entity, created_at DESC);"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_entities_chunk ON chunk_entities(chunk_id);")
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_chunks_entities_del AFTER DELETE ON chunks BEGIN
+                  DELETE FROM chunk_entities WHERE chunk_id = old.id;
+                END;
+                """
+            )
+            conn.execute("INSERT OR IGNORE INTO store_meta(key,value) VALUES ('generation','0');")
+            conn.execute("DROP TRIGGER IF EXISTS trg_chunks_generation_del;")
+            self._migrate_hot_meta(conn)
+            cols = {str(r[1]) for r in conn.execute("PRAGMA table_info(chunks)")}
+            if "emb_fmt" not in cols:
+                conn.execute("ALTER TABLE chunks ADD COLUMN emb_fmt INTEGER NOT NULL DEFAULT 0")
+            if "last_retrieved_at" not in cols:
+                conn.execute("ALTER TABLE chunks ADD COLUMN last_retrieved_at INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE chunks SET last_retrieved_at=created_at")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_retrieved ON chunks(last_retrieved_at);")
+            for col in ("simhash",) + tuple(f"sh_b{i}" for i in range(_SIMHASH_BANDS)):
+                if col not in cols:
+                    conn.execute(f"ALTER TABLE chunks ADD COLUMN {col} INTEGER")
+            for i in range(_SIMHASH_BANDS):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_chunks_sh_b{i} ON chunks(sh_b{i});")
+        self._migrate_bucket_postings(conn)
+        self._migrate_simhash(conn)
+        self._migrate_chunk_entities(conn)
+        self._migrate_auto_vacuum(conn)
+
+    def _migrate_auto_vacuum(self, conn: sqlite3.Connection) -> None:
+        if int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) != 0:
+            return
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("VACUUM;")
+
+    def _init_fts(self) -> bool:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_lex USING fts5(body, tokenize='unicode61');")
+                conn.execute(
+                    """
+                    CREATE TRIGGER IF NOT EXISTS trg_chunks_lex_del AFTER DELETE ON chunks BEGIN
+                      DELETE FROM chunks_lex WHERE rowid = old.rowid;
+                    END;
+                    """
+                )
+                if self._get_meta(conn, "fts_lex") != "1":
+                    conn.execute("DROP TRIGGER IF EXISTS trg_chunks_fts_ins;")
+                    conn.execute("DROP TRIGGER IF EXISTS trg_chunks_fts_del;")
+                    conn.execute("DROP TRIGGER IF EXISTS trg_chunks_fts_upd;")
+                    conn.execute("DROP TABLE IF EXISTS chunks_fts;")
+                    conn.execute("DELETE FROM chunks_lex;")
+                    cur = conn.execute("SELECT rowid,text FROM chunks")
+                    while True:
+                        rows = cur.fetchmany(1000)
+                        if not rows:
+                            break
+                        conn.executemany(
+                            "INSERT INTO chunks_lex(rowid,body) VALUES (?,?)",
+                            [(int(rowid), _lex_body(str(text))) for rowid, text in rows],
+                        )
+                    self._set_meta(conn, "fts_lex", "1")
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def _has_lex_table(self) -> bool:
+        conn = self._connect()
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='chunks_lex'").fetchone() is not None
+
+    def _migrate_hot_meta(self, conn: sqlite3.Connection) -> None:
+        cols = {str(r[1]) for r in conn.execute("PRAGMA table_info(chunks)")}
+        missing = [key for key in _HOT_META_KEYS if key not in cols]
+        for key in missing:
+            conn.execute(f"ALTER TABLE chunks ADD COLUMN {key}")
+        if missing:
+            sets = ",".join(
+                f"{key}=CASE WHEN json_valid(meta) AND json_type(meta,'$.{key}') IN ('text','integer','real') "
+                f"THEN json_extract(meta,'$.{key}') END"
+                for key in missing
+            )
+            conn.execute(f"UPDATE chunks SET {sets}")
+        for key in _HOT_META_KEYS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_chunks_{key} ON chunks({key});")
+
+    def _get_meta(self, conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM store_meta WHERE key=?", (key,)).fetchone()
+        return str(row[0]) if row else None
+
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value: str) -> None:
+        conn.execute("INSERT OR REPLACE INTO store_meta(key,value) VALUES (?,?)", (key, value))
+
+    def _bucket_rows(self, rowid: int, emb: np.ndarray) -> List[Tuple[int, int]]:
+        return [(int(b), rowid) for b in np.nonzero(emb)[0] if b < self._embedder.dim]
+
+    def _migrate_bucket_postings(self, conn: sqlite3.Connection) -> None:
+        if self._get_meta(conn, "bucket_postings") == "1":
+            return
+        last = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid,emb,emb_fmt FROM chunks WHERE rowid>? ORDER BY rowid LIMIT 2048", (last,)
+            ).fetchall()
+            if not rows:
+                break
+            postings: List[Tuple[int, int]] = []
+            for rowid, emb_blob, fmt in rows:
+                postings.extend(self._bucket_rows(int(rowid), _decode_emb(emb_blob, fmt)))
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO chunk_buckets(bucket,chunk_rowid) VALUES (?,?)", postings)
+            last = int(rows[-1][0])
+        with conn:
+            self._set_meta(conn, "bucket_postings", "1")
+
+    def _migrate_simhash(self, conn: sqlite3.Connection) -> None:
+        if self._get_meta(conn, "simhash") == "1":
+            return
+        bands = ",".join(f"sh_b{i}=?" for i in range(_SIMHASH_BANDS))
+        last = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid,text FROM chunks WHERE rowid>? ORDER BY rowid LIMIT 2048", (last,)
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for rowid, text in rows:
+                h = _simhash64(str(text))
+                updates.append((_signed64(h),) + _simhash_bands(h) + (int(rowid),))
+            with conn:
+                conn.executemany(f"UPDATE chunks SET simhash=?,{bands} WHERE rowid=?", updates)
+            last = int(rows[-1][0])
+        with conn:
+            self._set_meta(conn, "simhash", "1")
+
+    def _migrate_chunk_entities(self, conn: sqlite3.Connection) -> None:
+        if self._get_meta(conn, "chunk_entities") == "1":
+            return
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO chunk_entities(entity,chunk_id,created_at) "
+                "SELECT CAST(je.value AS TEXT), c.id, c.created_at FROM chunks c, json_each(c.meta,'$.entities') je "
+                "WHERE json_valid(c.meta) AND json_type(c.meta,'$.entities')='array' AND je.value IS NOT NULL"
+            )
+            self._set_meta(conn, "chunk_entities", "1")
+
+    def entity_chunk_ids(self, entities: Sequence[str], limit: int = 4) -> Dict[str, List[str]]:
+        out: Dict[str, List[str]] = {}
+        conn: Optional[sqlite3.Connection] = None
+        for e in dict.fromkeys(str(x) for x in entities):
+            ids = self._entity_cache.get(e) if limit <= _ENTITY_CACHE_DEPTH else None
+            if ids is None:
+                generation = self._entity_cache.generation
+                conn = conn or self._connect()
+                depth = max(limit, _ENTITY_CACHE_DEPTH)
+                ids = [
+                    str(r[0])
+                    for r in conn.execute(
+                        "SELECT chunk_id FROM chunk_entities WHERE entity=? ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                        (e, depth),
+                    )
+                ]
+                if depth == _ENTITY_CACHE_DEPTH:
+                    self._entity_cache.put(e, generation, ids)
+            out[e] = ids[:limit]
+        return out
+
+    def entity_cache_stats(self) -> Dict[str, int]:
+        return self._entity_cache.stats()
+
+    def _write_entities(
+        self, conn: sqlite3.Connection, items: Iterable[Tuple[str, Dict[str, Any]]], now: int
+    ) -> List[str]:
+        rows = [(e, cid, now) for cid, meta in items for e in _meta_entities(meta)]
+        if rows:
+            conn.executemany("INSERT OR REPLACE INTO chunk_entities(entity,chunk_id,created_at) VALUES (?,?,?)", rows)
+        return [e for e, _, _ in rows]
+
+    def _drop_entities(self, conn: sqlite3.Connection, ids: Sequence[str]) -> List[str]:
+        stale: List[str] = []
+        uniq = list(dict.fromkeys(ids))
+        for i in range(0, len(uniq), 500):
+            part = uniq[i : i + 500]
+            marks = ",".join("?" for _ in part)
+            found = [str(r[0]) for r in conn.execute(f"SELECT DISTINCT entity FROM chunk_entities WHERE chunk_id IN ({marks})", part)]
+            if found:
+                conn.execute(f"DELETE FROM chunk_entities WHERE chunk_id IN ({marks})", part)
+                stale.extend(found)
+        return stale
+
+    def _db_generation(self, conn: sqlite3.Connection) -> int:
+        return int(self._get_meta(conn, "generation") or 0)
+
+    def _bump_db_generation(self, conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE store_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+
+    def _load_mirror(self) -> None:
+        if self._snapshot and self._load_snapshot():
+            self._compact_resident()
+            return
+        matrix = _EmbeddingMatrix(self._embedder.dim, fmt=self._emb_format)
+        pos_by_id: Dict[str, int] = {}
+        cur = self._connect().execute("SELECT rowid,id,emb,emb_fmt FROM chunks ORDER BY rowid")
+        while True:
+            rows = cur.fetchmany(2048)
+            if not rows:
+                break
+            for rowid, cid, emb_blob, fmt in rows:
+                vec = _decode_emb(emb_blob, fmt)
+                pos_by_id[str(cid)] = matrix.append(vec, key=int(rowid))
+        postings = _BucketPostings(self._embedder.dim)
+        postings.build(matrix.dense())
+        with self._lock:
+            self._matrix = matrix
+            self._postings = postings
+            self._pos_by_id = pos_by_id
+
+    def _snapshot_diff(
+        self, conn: sqlite3.Connection, snap: VectorSnapshot
+    ) -> Tuple[np.ndarray, List[int]]:
+        alive = np.zeros(snap.keys.shape[0], dtype=bool)
+        reused: List[int] = []
+        n = snap.keys.shape[0]
+        cur = conn.execute("SELECT rowid,id FROM chunks WHERE rowid<=?", (snap.max_rowid,))
+        while True:
+            rows = cur.fetchmany(8192)
+            if not rows:
+                break
+            rowids = np.asarray([int(r[0]) for r in rows], dtype=np.int64)
+            idx = np.minimum(np.searchsorted(snap.keys, rowids), max(0, n - 1))
+            found = (snap.keys[idx] == rowids) if n else np.zeros(rowids.shape[0], dtype=bool)
+            for (rowid, cid), i, ok in zip(rows, idx.tolist(), found.tolist()):
+                if ok and snap.ids[i] == str(cid):
+                    alive[i] = True
+                else:
+                    reused.append(int(rowid))
+        return alive, reused
+
+    def _load_snapshot(self) -> bool:
+        snap = load_snapshot(self._snapshot_dir)
+        if snap is None or snap.dim != self._embedder.dim or snap.fmt != self._emb_format:
+            return False
+        if snap.data.dtype != _EMB_DTYPES[self._emb_format]:
+            return False
+        conn = self._connect()
+        matrix = _EmbeddingMatrix(self._embedder.dim, fmt=self._emb_format)
+        matrix.load(snap.data, snap.scales, snap.keys)
+        pos_by_id = dict(zip(snap.ids, range(len(snap.ids))))
+        postings = _BucketPostings(self._embedder.dim)
+        postings.load(snap.post_rows, snap.post_bounds)
+        reused: List[int] = []
+        stale = False
+        if self._db_generation(conn) != snap.generation:
+            alive, reused = self._snapshot_diff(conn, snap)
+            dead = np.nonzero(~alive)[0]
+            for pos in dead.tolist():
+                pos_by_id.pop(snap.ids[pos], None)
+            matrix.tombstone(dead)
+            stale = bool(dead.size or reused)
+        replay = conn.execute(
+            "SELECT rowid,id,emb,emb_fmt FROM chunks WHERE rowid>? ORDER BY rowid", (snap.max_rowid,)
+        ).fetchall()
+        for i in range(0, len(reused), 500):
+            part = reused[i : i + 500]
+            marks = ",".join("?" for _ in part)
+            replay.extend(conn.execute(f"SELECT rowid,id,emb,emb_fmt FROM chunks WHERE rowid IN ({marks})", part))
+        for rowid, cid, emb_blob, fmt in replay:
+            vec = _decode_emb(emb_blob, fmt)
+            pos = pos_by_id.get(str(cid))
+            if pos is None:
+                pos = matrix.append(vec, key=int(rowid))
+                pos_by_id[str(cid)] = pos
+            else:
+                matrix.set(pos, vec, key=int(rowid))
+            postings.add(pos, matrix.row(pos))
+        with self._lock:
+            self._matrix = matrix
+            self._postings = postings
+            self._pos_by_id = pos_by_id
+            self._snapshot_generation = -1 if (replay or stale) else self._generation
+        return True
+
+    def save_snapshot(self) -> Optional[str]:
+        with self._write_lock:
+            return self._save_snapshot()
+
+    def _save_snapshot(self) -> Optional[str]:
+        matrix = self._matrix
+        postings = self._postings
+        if matrix is None or postings is None:
+            return None
+        keys = matrix.keys()
+        n = keys.shape[0]
+        sel = np.nonzero(keys >= 0)[0]
+        sel = sel[np.argsort(keys[sel], kind="stable")]
+        ids_by_pos = [""] * n
+        for cid, pos in self._pos_by_id.items():
+            ids_by_pos[pos] = cid
+        new_pos = np.full(n, -1, dtype=np.int64)
+        new_pos[sel] = np.arange(sel.shape[0], dtype=np.int64)
+        rows, bounds = postings.csr()
+        bucket = np.repeat(np.arange(self._embedder.dim), np.diff(bounds))
+        mapped = new_pos[rows]
+        keep = mapped >= 0
+        counts = np.bincount(bucket[keep], minlength=self._embedder.dim)
+        out_keys = keys[sel]
+        snap = VectorSnapshot(
+            data=matrix.view()[sel],
+            scales=matrix.scales()[sel],
+            keys=out_keys,
+            ids=[ids_by_pos[p] for p in sel.tolist()],
+            post_rows=mapped[keep],
+            post_bounds=np.concatenate(([0], np.cumsum(counts))),
+            fmt=matrix.fmt,
+            dim=self._embedder.dim,
+            max_rowid=int(out_keys[-1]) if out_keys.shape[0] else 0,
+            generation=self._db_generation(self._connect()),
+        )
+        try:
+            path = save_snapshot(self._snapshot_dir, snap)
+        except (OSError, ValueError):
+            return None
+        self._snapshot_generation = self._generation
+        return path
+
+    def verify_snapshot(self, *, sample: int = 0) -> Dict[str, Any]:
+        manifest = read_manifest(self._snapshot_dir)
+        snap = load_snapshot(self._snapshot_dir, mmap_mode="r")
+        if manifest is None or snap is None:
+            return {"ok": False, "error": "missing or unreadable snapshot"}
+        conn = self._connect()
+        alive, reused = self._snapshot_diff(conn, snap)
+        positions = np.nonzero(alive)[0]
+        if sample > 0 and positions.shape[0] > sample:
+            positions = np.sort(np.random.default_rng(0).choice(positions, size=sample, replace=False))
+        check = _EmbeddingMatrix(snap.dim, fmt=snap.fmt)
+        check.load(snap.data, snap.scales, snap.keys)
+        mismatched = 0
+        for i in range(0, positions.shape[0], 500):
+            part = positions[i : i + 500]
+            rowids = [int(r) for r in snap.keys[part]]
+            marks = ",".join("?" for _ in rowids)
+            stored = {
+                int(r): _decode_emb(b, f)
+                for r, b, f in conn.execute(f"SELECT rowid,emb,emb_fmt FROM chunks WHERE rowid IN ({marks})", rowids)
+            }
+            q = np.stack([check.normalize(stored[r]) for r in rowids]) if rowids else np.zeros((0, snap.dim))
+            got = check.dense(part).astype(np.float32)
+            tol = 1e-5 if snap.fmt == "f32" else 2e-2
+            mismatched += int(np.count_nonzero(np.max(np.abs(got - q), axis=1) > tol))
+        newer = int(conn.execute("SELECT count(*) FROM chunks WHERE rowid>?", (snap.max_rowid,)).fetchone()[0])
+        db_generation = self._db_generation(conn)
+        return {
+            "ok": mismatched == 0,
+            "count": len(snap.ids),
+            "fmt": snap.fmt,
+            "max_rowid": snap.max_rowid,
+            "generation": snap.generation,
+            "db_generation": db_generation,
+            "created_at": int(manifest.get("created_at", 0)),
+            "checked": int(positions.shape[0]),
+            "mismatched": mismatched,
+            "stale": int(np.count_nonzero(~alive)),
+            "replay": newer + len(reused),
+        }
 
     def _pack_emb(self, emb: Sequence[float]) -> bytes:
-        return struct.pack(f"<{len(emb)}f", *[float(v) for v in emb])
+        return _encode_emb(np.asarray(emb, dtype=np.float32), self._emb_format)
+
+    def _chunk_from_row(self, cid: Any, text: Any, emb_blob: bytes, fmt: Optional[int], meta_json: Optional[str]) -> MemoryChunk:
+        emb = tuple(_decode_emb(emb_blob, fmt).tolist())
+        return MemoryChunk(id=str(cid), text=str(text), embedding=emb, meta=_decode_meta(meta_json))
 
-    def _unpack_emb(self, blob: bytes) -> Tuple[float, ...]:
-        if not blob:
-            return tuple()
-        dim = len(blob) // 4
-        return tuple(struct.unpack(f"<{dim}f", blob))
+    def _rescore_exact(self, query: str, pool_scored: List[Tuple[float, MemoryChunk]], pool: int) -> List[Tuple[float, MemoryChunk]]:
+        if not pool_scored:
+            return pool_scored
+        q = np.asarray(self._embedder.embed(query), dtype=np.float32)
+        embs = self._embedder.embed_many([ch.text for _, ch in pool_scored])
+        scores = embs @ q
+        order = np.argsort(-scores, kind="stable")[:pool]
+        return [
+            (float(scores[i]), replace(pool_scored[i][1], embedding=tuple(embs[i].tolist())))
+            for i in order.tolist()
+            if scores[i] > 0.0
+        ]
 
     def add(self, chunk_id: str, text: str, meta: Optional[Dict[str, Any]] = None) -> None:
-        emb = self._embedder.embed(text)
-        meta_json = json.dumps(meta or {}, ensure_ascii=False)
+        self.add_many([(chunk_id, text, meta)])
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[str]:
+        batch = [(str(cid), str(text), meta or {}) for cid, text, meta in items]
+        if not batch:
+            return []
+        with self._write_lock:
+            return self._write_batch(batch)
+
+    def dedup_stats(self) -> Dict[str, int]:
+        return dict(self._dedup_counts)
+
+    def _find_duplicate(self, conn: sqlite3.Connection, h: int) -> Optional[Tuple[int, str, str]]:
+        bands = _simhash_bands(h)
+        where = " OR ".join(f"sh_b{i}=?" for i in range(_SIMHASH_BANDS))
+        best: Optional[Tuple[int, int, str, str]] = None
+        for rowid, cid, meta_json, other in conn.execute(
+            f"SELECT rowid,id,meta,simhash FROM chunks WHERE {where}", bands
+        ):
+            if other is None:
+                continue
+            dist = _hamming64(h, int(other))
+            if dist <= self._dedup_max_distance and (best is None or dist < best[0]):
+                best = (dist, int(rowid), str(cid), meta_json)
+        return None if best is None else best[1:]
+
+    def _local_duplicate(self, pending: Dict[Tuple[int, int], List[int]], hashes: List[int], h: int) -> Optional[int]:
+        for band in enumerate(_simhash_bands(h)):
+            for j in pending.get(band, []):
+                if _hamming64(h, hashes[j]) <= self._dedup_max_distance:
+                    return j
+        return None
+
+    def _dedup_batch(
+        self,
+        conn: sqlite3.Connection,
+        batch: List[Tuple[str, str, Dict[str, Any]]],
+        hashes: List[int],
+    ) -> Tuple[List[Tuple[str, str, Dict[str, Any]]], List[int], List[str]]:
+        existing = self._rowids_for_ids(conn, [cid for cid, _, _ in batch])
+        merge = self._dedup == "merge"
+        kept: List[Tuple[str, str, Dict[str, Any]]] = []
+        kept_hashes: List[int] = []
+        resolved: List[str] = []
+        pending: Dict[Tuple[int, int], List[int]] = {}
+        merges: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+        for (cid, text, meta), h in zip(batch, hashes):
+            self._dedup_counts["checked"] += 1
+            if h and cid not in existing:
+                local = self._local_duplicate(pending, kept_hashes, h)
+                if local is not None:
+                    dup_id, dup_text, dup_meta = kept[local]
+                    if merge:
+                        kept[local] = (dup_id, dup_text, _merge_meta(dup_meta, meta))
+                    self._dedup_counts["merged" if merge else "skipped"] += 1
+                    resolved.append(dup_id)
+                    continue
+                dup = self._find_duplicate(conn, h)
+                if dup is not None:
+                    rowid, dup_id, dup_meta_json = dup
+                    if merge:
+                        base = merges[rowid][1] if rowid in merges else _decode_meta(dup_meta_json)
+                        merges[rowid] = (dup_id, _merge_meta(base, meta))
+                    self._dedup_counts["merged" if merge else "skipped"] += 1
+                    resolved.append(dup_id)
+                    continue
+                for band in enumerate(_simhash_bands(h)):
+                    pending.setdefault(band, []).append(len(kept))
+            kept.append((cid, text, meta))
+            kept_hashes.append(h)
+            resolved.append(cid)
+        if merges:
+            now = int(time.time())
+            with conn:
+                touched = self._write_entities(conn, merges.values(), now)
+                conn.executemany(
+                    "UPDATE chunks SET meta=?,source=?,filename=?,file_id=?,kind=?,"
+                    "last_retrieved_at=max(last_retrieved_at,?) WHERE rowid=?",
+                    [
+                        (json.dumps(meta, ensure_ascii=False),)
+                        + tuple(_hot_meta_value(meta, key) for key in _HOT_META_KEYS)
+                        + (now, rowid)
+                        for rowid, (_, meta) in merges.items()
+                    ],
+                )
+            self._entity_cache.discard(touched)
+            with self._lock:
+                self._generation += 1
+        return kept, kept_hashes, resolved
+
+    def _write_batch(self, batch: List[Tuple[str, str, Dict[str, Any]]]) -> List[str]:
+        hashes = [_simhash64(text) for _, text, _ in batch]
+        resolved = [cid for cid, _, _ in batch]
+        if self._dedup != "off":
+            batch, hashes, resolved = self._dedup_batch(self._connect(), batch, hashes)
+            if not batch:
+                return resolved
+        embs = self._embedder.embed_many([text for _, text, _ in batch])
+        now = int(time.time())
+        rows = [
+            (cid, text, self._pack_emb(emb), json.dumps(meta, ensure_ascii=False), now)
+            + tuple(_hot_meta_value(meta, key) for key in _HOT_META_KEYS)
+            for (cid, text, meta), emb in zip(batch, embs)
+        ]
+        fmt_code = _EMB_FORMATS[self._emb_format]
+        rows = [r + (fmt_code, now, _signed64(h)) + _simhash_bands(h) for r, h in zip(rows, hashes)]
         conn = self._connect()
-        try:
-            conn.execute(
-                "INSERT OR REPLACE INTO chunks(id,text,emb,meta,created_at) VALUES (?,?,?,?,?)",
-                (chunk_id, text, self._pack_emb(emb), meta_json, int(time.time())),
+        ids = [cid for cid, _, _ in batch]
+        with conn:
+            touched = self._drop_entities(conn, ids)
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks"
+                "(id,text,emb,meta,created_at,source,filename,file_id,kind,emb_fmt,last_retrieved_at,"
+                "simhash,sh_b0,sh_b1,sh_b2,sh_b3) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                rows,
             )
-            conn.commit()
-        finally:
-            conn.close()
+            rowid_by_id = self._rowids_for_ids(conn, [cid for cid, _, _ in batch])
+            postings: List[Tuple[int, int]] = []
+            for (cid, _, _), emb in zip(batch, embs):
+                rowid = rowid_by_id.get(cid)
+                if rowid is not None:
+                    postings.extend(self._bucket_rows(rowid, emb))
+            conn.executemany("INSERT OR IGNORE INTO chunk_buckets(bucket,chunk_rowid) VALUES (?,?)", postings)
+            if self._lex_sync:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO chunks_lex(rowid,body) VALUES (?,?)",
+                    [(rowid_by_id[cid], _lex_body(text)) for cid, text, _ in batch if cid in rowid_by_id],
+                )
+            touched.extend(self._write_entities(conn, ((cid, meta) for cid, _, meta in batch), now))
+        self._entity_cache.discard(touched)
+        with self._lock:
+            self._generation += 1
+            if self._matrix is None:
+                return resolved
+            for (cid, _, _), emb in zip(batch, embs):
+                rowid = rowid_by_id.get(cid)
+                if rowid is None:
+                    continue
+                pos = self._pos_by_id.get(cid)
+                if pos is None:
+                    pos = self._matrix.append(emb, key=rowid)
+                    self._pos_by_id[cid] = pos
+                else:
+                    self._matrix.set(pos, emb, key=rowid)
+                row = self._matrix.row(pos)
+                if self._postings is not None:
+                    self._postings.add(pos, row)
+                if self._ann is not None:
+                    self._ann.add(pos, row)
+        return resolved
+
+    def _rowids_for_ids(self, conn: sqlite3.Connection, ids: Sequence[str]) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        uniq = list(dict.fromkeys(ids))
+        for i in range(0, len(uniq), 500):
+            part = uniq[i : i + 500]
+            marks = ",".join("?" for _ in part)
+            for rowid, cid in conn.execute(f"SELECT rowid,id FROM chunks WHERE id IN ({marks})", part):
+                out[str(cid)] = int(rowid)
+        return out
 
     def search(
         self,
@@ -208,55 +1822,272 @@ class PersistentVectorStore:
         *,
         mmr_lambda: float = 0.0,
         candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
     ) -> List[MemoryChunk]:
+        pool_scored = self.search_scored(query, k, filters, candidate_pool=candidate_pool, hybrid=hybrid)
+        return _select(pool_scored, k, mmr_lambda)
+
+    def search_scored(
+        self,
+        query: str,
+        k: int = 4,
+        filters: Optional[Dict[str, Any]] = None,
+        *,
+        candidate_pool: Optional[int] = None,
+        hybrid: bool = False,
+    ) -> List[Tuple[float, MemoryChunk]]:
         if k <= 0:
             return []
-        q = tuple(self._embedder.embed(query))
+        key = _query_key(query, k, filters, candidate_pool, hybrid)
+        generation = self._generation
+        pool_scored = self._cache.get(key, generation)
+        if pool_scored is None:
+            pool_scored = self._search_uncached(query, k, filters, candidate_pool=candidate_pool, hybrid=hybrid)
+            self._cache.put(key, generation, pool_scored)
+        if pool_scored:
+            now = int(time.time())
+            with self._lock:
+                for _, ch in pool_scored[:k]:
+                    self._touched[ch.id] = now
+        return pool_scored
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+    def score_ids(self, query: str, ids: Sequence[str]) -> List[Tuple[float, MemoryChunk]]:
+        uniq = list(dict.fromkeys(str(cid) for cid in ids))
+        if not uniq:
+            return []
+        by_id: Dict[str, MemoryChunk] = {}
         conn = self._connect()
+        for i in range(0, len(uniq), 500):
+            part = uniq[i : i + 500]
+            marks = ",".join("?" for _ in part)
+            for row in conn.execute(f"SELECT id,text,emb,emb_fmt,meta FROM chunks WHERE id IN ({marks})", part):
+                ch = self._chunk_from_row(*row)
+                by_id[ch.id] = ch
+        return _score_chunks(self._embedder.embed(query), [by_id[cid] for cid in uniq if cid in by_id])
+
+    def _search_uncached(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        *,
+        candidate_pool: Optional[int],
+        hybrid: bool,
+    ) -> List[Tuple[float, MemoryChunk]]:
+        if hybrid and self._fts:
+            limit = _pool_size(k, candidate_pool) * _LEXICAL_POOL_MULT
+            lexical = self._lexical_rowids(query, limit, filters)
+            if lexical:
+                hits = [
+                    (sc + _LEXICAL_BONUS, c)
+                    for sc, c in self._search(query, k, filters, candidate_pool=candidate_pool, restrict=lexical)
+                ]
+                if len(hits) >= k:
+                    return hits
+                seen = {c.id for _, c in hits}
+                rest = self._search(query, k, filters, candidate_pool=candidate_pool)
+                return hits + [(sc, c) for sc, c in rest if c.id not in seen]
+        return self._search(query, k, filters, candidate_pool=candidate_pool)
+
+    def _lexical_rowids(self, query: str, limit: int, filters: Optional[Dict[str, Any]]) -> List[int]:
+        match = _lex_match(query)
+        if not match:
+            return []
+        hot, _ = _split_filters(filters)
+        where = "".join(f" AND chunks.{key}=?" for key in hot)
+        sql = (
+            "SELECT chunks_lex.rowid FROM chunks_lex JOIN chunks ON chunks.rowid = chunks_lex.rowid "
+            f"WHERE chunks_lex MATCH ?{where}"
+        )
         try:
-            rows = conn.execute("SELECT id,text,emb,meta FROM chunks ORDER BY created_at DESC").fetchall()
-        finally:
-            conn.close()
-        if not rows:
+            return self._capped_rowids(
+                self._connect(), sql, [match, *hot.values()], limit, limit * _LEXICAL_MAX_MATCH_MULT
+            )
+        except sqlite3.OperationalError:
             return []
-        scored: List[Tuple[float, MemoryChunk]] = []
-        for cid, text, emb_blob, meta_json in rows:
-            meta = {}
-            try:
-                meta = json.loads(meta_json) if meta_json else {}
-            except Exception:
-                meta = {}
-            if filters:
-                ok = True
-                for fk, fv in filters.items():
-                    if meta.get(fk) != fv:
-                        ok = False
-                        break
-                if not ok:
+
+    def _capped_rowids(
+        self, conn: sqlite3.Connection, sql: str, params: List[Any], limit: int, cap: int
+    ) -> List[int]:
+        rows = conn.execute(f"{sql} LIMIT ?", params + [cap + 1]).fetchall()
+        if len(rows) > cap:
+            return []
+        if len(rows) > limit:
+            rows = conn.execute(f"{sql} ORDER BY rank LIMIT ?", params + [limit]).fetchall()
+        return [int(r[0]) for r in rows]
+
+    def _search(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        *,
+        candidate_pool: Optional[int],
+        restrict: Optional[List[int]] = None,
+    ) -> List[Tuple[float, MemoryChunk]]:
+        if self._matrix is None:
+            return self._search_scan(query, k, filters, candidate_pool=candidate_pool, restrict=restrict)
+
+        with self._lock:
+            matrix = self._matrix
+            postings = self._postings
+            mat = matrix.view()
+            keys = matrix.keys()
+        n = mat.shape[0]
+        if n == 0:
+            return []
+        q = matrix.normalize(self._embedder.embed(query))
+        buckets = np.nonzero(q)[0]
+        if buckets.size == 0:
+            return []
+
+        positions: Optional[np.ndarray] = None
+        if filters:
+            positions = matrix.positions_for_keys(self._filter_rowids(filters))
+            if positions.size == 0:
+                return []
+        if restrict is not None:
+            positions = _restrict(positions, matrix.positions_for_keys(restrict))
+            if positions.size == 0:
+                return []
+        elif postings is not None:
+            cand = postings.candidates(buckets)
+            if cand.size < n * _PRUNE_MAX_FRACTION:
+                positions = _restrict(positions, cand[cand < n])
+                if positions.size == 0:
+                    return []
+        ann = self._ensure_ann(n) if restrict is None else None
+        if ann is not None and (positions is None or positions.size >= self._ann_min_chunks):
+            cand = ann.candidates(q, nprobe=self._ann_nprobe)
+            positions = _restrict(positions, cand[cand < n])
+            if positions.size == 0:
+                return []
+        scores = matrix.scores(q, positions, n=n)
+        pool = _pool_size(k, candidate_pool)
+        compact = matrix.fmt != "f32"
+        top = _top_k_desc(scores, pool * 2 if compact else pool)
+        top = top[scores[top] > 0.0]
+        if top.size == 0:
+            return []
+        pos = positions[top] if positions is not None else top
+        rowids = [int(r) for r in keys[pos]]
+
+        by_rowid = self._fetch_rows(rowids)
+        pool_scored: List[Tuple[float, MemoryChunk]] = []
+        for i, rowid in zip(top, rowids):
+            ch = by_rowid.get(rowid)
+            if ch is not None:
+                pool_scored.append((float(scores[i]), ch))
+        if compact:
+            return self._rescore_exact(query, pool_scored, pool)
+        return pool_scored
+
+    def _where(self, hot: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        if not hot:
+            return "", []
+        return " WHERE " + " AND ".join(f"{key}=?" for key in hot), list(hot.values())
+
+    def _filter_rowids(self, filters: Dict[str, Any]) -> List[int]:
+        hot, cold = _split_filters(filters)
+        where, params = self._where(hot)
+        conn = self._connect()
+        if not cold:
+            return [int(r[0]) for r in conn.execute(f"SELECT rowid FROM chunks{where}", params)]
+        out: List[int] = []
+        cur = conn.execute(f"SELECT rowid,meta FROM chunks{where}", params)
+        while True:
+            rows = cur.fetchmany(2048)
+            if not rows:
+                break
+            for rowid, meta_json in rows:
+                if _matches_filters(_decode_meta(meta_json), cold):
+                    out.append(int(rowid))
+        return out
+
+    def _fetch_rows(self, rowids: Sequence[int]) -> Dict[int, MemoryChunk]:
+        if not rowids:
+            return {}
+        marks = ",".join("?" for _ in rowids)
+        rows = self._connect().execute(
+            f"SELECT rowid,id,text,emb,emb_fmt,meta FROM chunks WHERE rowid IN ({marks})", list(rowids)
+        ).fetchall()
+        out: Dict[int, MemoryChunk] = {}
+        for rowid, cid, text, emb_blob, fmt, meta_json in rows:
+            out[int(rowid)] = self._chunk_from_row(cid, text, emb_blob, fmt, meta_json)
+        return out
+
+    def _search_scan(
+        self,
+        query: str,
+        k: int,
+        filters: Optional[Dict[str, Any]],
+        *,
+        candidate_pool: Optional[int],
+        restrict: Optional[List[int]] = None,
+    ) -> List[Tuple[float, MemoryChunk]]:
+        dim = self._embedder.dim
+        q = np.asarray(self._embedder.embed(query), dtype=np.float32)
+        buckets = [int(b) for b in np.nonzero(q)[0]]
+        if not buckets:
+            return []
+        hot, cold = _split_filters(filters)
+        where, params = self._where(hot)
+        if restrict is not None:
+            marks = ",".join("?" for _ in restrict)
+            where += (" AND " if where else " WHERE ") + f"rowid IN ({marks})"
+            params = params + list(restrict)
+        else:
+            marks = ",".join("?" for _ in buckets)
+            where += (" AND " if where else " WHERE ") + (
+                f"rowid IN (SELECT chunk_rowid FROM chunk_buckets WHERE bucket IN ({marks}))"
+            )
+            params = params + buckets
+        cols = "rowid,emb,emb_fmt,meta" if cold else "rowid,emb,emb_fmt"
+        cur = self._connect().execute(f"SELECT {cols} FROM chunks{where} ORDER BY created_at DESC", params)
+
+        pool = _pool_size(k, candidate_pool)
+        best: List[Tuple[float, int, int]] = []
+        seq = 0
+        compact = False
+        while True:
+            rows = cur.fetchmany(2048)
+            if not rows:
+                break
+            if cold:
+                rows = [r for r in rows if _matches_filters(_decode_meta(r[3]), cold)]
+                if not rows:
                     continue
-            emb = self._unpack_emb(emb_blob)
-            ch = MemoryChunk(id=str(cid), text=str(text), embedding=emb, meta=meta)
-            scored.append((_cosine(q, emb), ch))
-        scored.sort(key=lambda t: t[0], reverse=True)
-        pool = int(candidate_pool or 0)
-        if pool <= 0:
-            pool = max(k * 4, 12)
-        pool_scored = [(s, c) for s, c in scored[:pool] if s > 0.0]
-        if mmr_lambda and mmr_lambda > 0.0:
-            return _mmr_select(pool_scored, k=k, lambda_mult=mmr_lambda)
-        return [c for s, c in pool_scored[:k]]
+            vecs = np.zeros((len(rows), dim), dtype=np.float32)
+            rowids: List[int] = []
+            for i, row in enumerate(rows):
+                compact = compact or int(row[2] or 0) != _EMB_FORMATS["f32"]
+                v = _decode_emb(row[1], row[2])[:dim]
+                vecs[i, : v.shape[0]] = v
+                rowids.append(int(row[0]))
+            norms = np.linalg.norm(vecs, axis=1)
+            norms[norms == 0.0] = 1.0
+            scores = (vecs @ q) / norms
+            batch = [(float(sc), -(seq + i), rid) for i, (sc, rid) in enumerate(zip(scores.tolist(), rowids))]
+            seq += len(rows)
+            best = heapq.nlargest(pool * 2, itertools.chain(best, batch))
+        best = [t for t in best if t[0] > 0.0]
+        if not best:
+            return []
+
+        by_rowid = self._fetch_rows([rid for _, _, rid in best])
+        pool_scored = [(sc, by_rowid[rid]) for sc, _, rid in best if rid in by_rowid]
+        if compact:
+            return self._rescore_exact(query, pool_scored, pool)
+        return pool_scored[:pool]
 
     def iter_chunks(self) -> Iterable[MemoryChunk]:
-        conn = self._connect()
-        try:
-            rows = conn.execute("SELECT id,text,emb,meta FROM chunks ORDER BY created_at DESC").fetchall()
-        finally:
-            conn.close()
-        for cid, text, emb_blob, meta_json in rows:
-            meta = {}
-            try:
-                meta = json.loads(meta_json) if meta_json else {}
-            except Exception:
-                meta = {}
-            emb = self._unpack_emb(emb_blob)
-            yield MemoryChunk(id=str(cid), text=str(text), embedding=emb, meta=meta)
+        cur = self._connect().execute("SELECT id,text,emb,emb_fmt,meta FROM chunks ORDER BY created_at DESC")
+        while True:
+            rows = cur.fetchmany(512)
+            if not rows:
+                break
+            for row in rows:
+                yield self._chunk_from_row(*row)
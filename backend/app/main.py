@@ -1,11 +1,13 @@
+import hmac
 import json
 import logging
 import asyncio
 import uuid
 import time
 import os
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
@@ -14,30 +16,152 @@ from app.core.config import get_settings
 from app.core.context_manager import ContextManager
 from app.core.chart_parser import parse_chart_spec
 from app.core.context_summary import summarize_system_context
-from app.core.file_indexer import index_text
+from app.core.file_indexer import segment_text, stored_ids
 from app.core.intent_decoder import IntentDecoder
 from app.core.kimi_client import KimiClient, KimiError
 from app.core.kimi_tools import build_streamvis_tools, get_raw_tool_calls, parse_tool_calls_from_chat_response
+from app.core.memory_namespaces import GLOBAL_NAMESPACE, MemoryNamespaces
+from app.core.memory_writer import MemoryWriter
 from app.core.moonshot_files import MoonshotError, MoonshotFilesClient
 from app.core.renderer import IncrementalRenderer
+from app.core.token_budget import configure_tokenizer
 from app.core.vector_store import PersistentVectorStore
 from app.core.waitk_policy import WaitKPolicy
 from app.core.xfyun_rtasr import stream_rtasr
 from app.core.xfyun_voiceprint import delete_voiceprint, register_voiceprint, update_voiceprint
 from app.models.ws import ChartDeltaEvent, ClientMessage, GraphDeltaEvent, ImageEvent, TextDeltaEvent, TranscriptDeltaEvent
 
-app = FastAPI(title="StreamVis API")
+
+def _maintain_memory(store: PersistentVectorStore) -> dict:
+    kwargs = dict(
+        max_chunks=settings.memory_max_chunks,
+        max_age_s=settings.memory_max_age_days * 86400.0,
+        source_quotas=settings.memory_source_quotas,
+        batch_size=settings.memory_maintenance_batch,
+        vacuum_pages=settings.memory_vacuum_pages,
+    )
+    out = {GLOBAL_NAMESPACE: store.maintain(**kwargs)}
+    if _memory_namespaces is not None:
+        out.update(_memory_namespaces.maintain_open(**kwargs))
+        for stem in _memory_namespaces.sweep(
+            settings.memory_namespace_keys.values(), max_idle_s=settings.memory_namespace_idle_days * 86400.0
+        ):
+            logger.info("memory namespace swept file=%s", stem)
+    return out
+
+
+async def _memory_maintenance_loop(store: PersistentVectorStore) -> None:
+    interval = max(1.0, float(settings.memory_maintenance_interval_s))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stats = await asyncio.to_thread(_maintain_memory, store)
+        except Exception:
+            logger.exception("memory maintenance failed")
+            continue
+        for ns, st in stats.items():
+            if st["deleted"] or st["vacuumed_pages"]:
+                logger.info("memory maintenance ns=%s %s", ns, st)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    maintenance = None
+    if _memory_writer:
+        _memory_writer.start()
+    if _memory_store and settings.memory_maintenance_interval_s > 0:
+        maintenance = asyncio.create_task(_memory_maintenance_loop(_memory_store))
+    yield
+    if maintenance is not None:
+        maintenance.cancel()
+        try:
+            await maintenance
+        except asyncio.CancelledError:
+            pass
+    if _memory_writer:
+        await _memory_writer.close()
+    if _memory_namespaces:
+        _memory_namespaces.close()
+    if _memory_store:
+        _memory_store.close()
+
+
+app = FastAPI(title="StreamVis API", lifespan=lifespan)
 
 settings = get_settings()
 logger = logging.getLogger("streamvis")
 
 _backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _backend_path(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(_backend_dir, path)
+
+
+if settings.tokenizer_path:
+    _tokenizer = configure_tokenizer(_backend_path(settings.tokenizer_path), cache_size=settings.tokenizer_cache_size)
+    if _tokenizer.name == "heuristic":
+        logger.warning("tokenizer not loaded from %s; using heuristic token estimates", settings.tokenizer_path)
+
+
+def _open_memory_store(db_path: str) -> PersistentVectorStore:
+    return PersistentVectorStore(
+        db_path=db_path,
+        resident_cache=settings.memory_resident_cache,
+        mmap_size=settings.memory_mmap_size,
+        cache_size=settings.memory_cache_size,
+        ann_min_chunks=settings.memory_ann_min_chunks,
+        ann_nlist=settings.memory_ann_nlist,
+        ann_nprobe=settings.memory_ann_nprobe,
+        emb_format=settings.memory_emb_format,
+        fts=settings.memory_fts,
+        query_cache_size=settings.memory_query_cache_size,
+        entity_cache_size=settings.memory_entity_cache_size,
+        dedup=settings.memory_dedup,
+        dedup_max_distance=settings.memory_dedup_max_distance,
+        snapshot=settings.memory_snapshot,
+    )
+
+
 _memory_store: PersistentVectorStore | None = None
+_memory_namespaces: MemoryNamespaces | None = None
+_memory_writer: MemoryWriter | None = None
 if settings.enable_persistent_memory:
-    db_path = settings.memory_db_path
-    if not os.path.isabs(db_path):
-        db_path = os.path.join(_backend_dir, db_path)
-    _memory_store = PersistentVectorStore(db_path=db_path)
+    _memory_store = _open_memory_store(_backend_path(settings.memory_db_path))
+    if settings.memory_write_behind:
+        _memory_writer = MemoryWriter(max_queue=settings.memory_write_queue, max_batch=settings.memory_write_batch)
+    if settings.memory_namespaces:
+        _memory_namespaces = MemoryNamespaces(
+            base_dir=_backend_path(settings.memory_namespace_dir),
+            factory=_open_memory_store,
+            global_store=_memory_store,
+            max_open=settings.memory_namespace_max_open,
+        )
+
+
+def _namespace_for(key: str) -> str | None:
+    presented = (key or "").strip().encode("utf-8")
+    if not presented:
+        return None
+    for k, ns in settings.memory_namespace_keys.items():
+        if hmac.compare_digest(k.encode("utf-8"), presented):
+            return ns
+    return None
+
+
+def _memory_view(key: str, *, write: bool = False):
+    if _memory_namespaces is None:
+        return _memory_store
+    ns = _namespace_for(key)
+    if ns is None:
+        if (key or "").strip():
+            raise HTTPException(status_code=403, detail="无效的记忆库密钥")
+        return None if write else _memory_store
+    if ns == GLOBAL_NAMESPACE:
+        return _memory_store
+    read = [ns] if write else [ns, GLOBAL_NAMESPACE]
+    return _memory_namespaces.view(write=ns, read=read)
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -74,11 +198,14 @@ async def kimi_extract_file(file: UploadFile = File(...)):
 
 
 @app.post("/api/kimi/files/index")
-async def kimi_index_file(file: UploadFile = File(...)):
+async def kimi_index_file(file: UploadFile = File(...), x_memory_key: str = Header(default="")):
     if not settings.enable_kimi or not settings.moonshot_api_key:
         raise HTTPException(status_code=400, detail="Kimi 未启用或未配置 MOONSHOT_API_KEY")
     if not _memory_store:
         raise HTTPException(status_code=400, detail="未启用持久化记忆库")
+    store = _memory_view(x_memory_key, write=True)
+    if store is None:
+        raise HTTPException(status_code=403, detail="写入记忆库需要有效的 X-Memory-Key")
     raw = await file.read()
     if not raw:
         raise HTTPException(status_code=400, detail="空文件")
@@ -88,12 +215,17 @@ async def kimi_index_file(file: UploadFile = File(...)):
         content = await asyncio.to_thread(client.retrieve_content, file_id=uploaded.id)
         await asyncio.to_thread(client.delete, file_id=uploaded.id)
 
-        count, ids = await asyncio.to_thread(
-            index_text,
-            store=_memory_store,
+        items = await asyncio.to_thread(
+            segment_text,
             text=content,
             meta={"source": "file", "filename": uploaded.filename, "file_id": uploaded.id, "kind": "file"},
         )
+        if _memory_writer:
+            stored = await _memory_writer.submit(store, items)
+        else:
+            stored = await asyncio.to_thread(store.add_many, items)
+        ids = stored_ids(stored, items)
+        count = len(ids)
 
         system_ctx = f"[File:{uploaded.filename}#{uploaded.id}] 已索引 {count} 段，可在提问时按需检索引用。"
         if settings.enable_context_summary and content and len(content) > settings.system_context_max_chars:
@@ -118,17 +250,42 @@ async def kimi_index_file(file: UploadFile = File(...)):
 
 
 @app.get("/api/memory/search")
-async def memory_search(q: str, k: int = 6):
+async def memory_search(q: str, k: int = 6, mode: str = "", x_memory_key: str = Header(default="")):
     if not _memory_store:
         raise HTTPException(status_code=400, detail="未启用持久化记忆库")
     kk = max(1, min(20, int(k)))
-    hits = await asyncio.to_thread(_memory_store.search, q, kk, None, mmr_lambda=settings.mmr_lambda, candidate_pool=kk * settings.mmr_pool_mult)
+    m = (mode or "").strip().lower()
+    if m not in {"", "vector", "hybrid"}:
+        raise HTTPException(status_code=400, detail="mode 仅支持 vector / hybrid")
+    hybrid = settings.memory_hybrid_search if not m else m == "hybrid"
+    hits = await asyncio.to_thread(
+        _memory_view(x_memory_key).search,
+        q,
+        kk,
+        None,
+        mmr_lambda=settings.mmr_lambda,
+        candidate_pool=kk * settings.mmr_pool_mult,
+        hybrid=hybrid,
+    )
     out = []
     for h in hits:
         out.append({"id": h.id, "text": h.text[:220], "meta": h.meta})
     return {"hits": out}
 
 
+@app.get("/api/memory/stats")
+async def memory_stats():
+    if not _memory_store:
+        raise HTTPException(status_code=400, detail="未启用持久化记忆库")
+    return {
+        "query_cache": _memory_store.cache_stats(),
+        "entity_cache": _memory_store.entity_cache_stats(),
+        "dedup": _memory_store.dedup_stats(),
+        "open_namespaces": _memory_namespaces.open_namespaces() if _memory_namespaces else [],
+        "write_behind": _memory_writer.stats() if _memory_writer else None,
+    }
+
+
 @app.post("/api/xfyun/voiceprint/register")
 async def xfyun_voiceprint_register(file: UploadFile = File(...), uid: str = ""):
     if not settings.xfyun_enable:
@@ -202,13 +359,25 @@ async def xfyun_voiceprint_delete(feature_ids: str):
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     session_id = str(uuid.uuid4())[:8]
+    memory_key = websocket.headers.get("x-memory-key") or websocket.query_params.get("memory_key") or ""
+    try:
+        store = _memory_view(memory_key)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
     context_manager = ContextManager(
         l1_max_turns=settings.l1_max_turns,
         sink_turns=settings.sink_turns,
         retrieval_k=settings.retrieval_k,
         mmr_lambda=settings.mmr_lambda,
         mmr_pool_mult=settings.mmr_pool_mult,
-        store=_memory_store,
+        entity_boost=settings.entity_boost,
+        packing=settings.prompt_packing,
+        recency_decay=settings.prompt_recency_decay,
+        hybrid_search=settings.memory_hybrid_search,
+        store=store,
+        writer=_memory_writer if store is not None else None,
+        session=session_id,
     )
     intent_decoder = IntentDecoder()
     renderer = IncrementalRenderer(max_nodes=settings.graph_max_nodes, max_edges=settings.graph_max_edges)
@@ -280,6 +449,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 continue
 
             context_manager.add_user_input(user_input)
+            if _memory_writer:
+                await _memory_writer.wait_session(session_id)
             augmented_context = context_manager.get_augmented_context(user_input, max_prompt_tokens=settings.kimi_max_prompt_tokens)
             intent = intent_decoder.detect(user_input, augmented_context)
             intent["memory_hits"] = len(context_manager.retrieve(user_input, k=settings.retrieval_k))
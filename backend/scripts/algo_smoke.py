@@ -1,16 +1,40 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import json
+import logging
 import os
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from app.core.context_manager import ContextManager
 from app.core.chart_parser import parse_chart_spec
 from app.core.kimi_tools import get_raw_tool_calls, parse_tool_calls_from_chat_response
+from app.core.memory_namespaces import MemoryNamespaces
+from app.core.memory_writer import MemoryWriter
 from app.core.renderer import IncrementalRenderer
-from app.core.token_budget import budget_messages, estimate_tokens
-from app.core.vector_store import PersistentVectorStore
+from app.core.token_budget import (
+    budget_messages,
+    configure_tokenizer,
+    estimate_message_tokens,
+    estimate_tokens,
+    message_token_counts,
+    message_token_counts_many,
+    pack_messages,
+    truncate_text_to_sentences,
+    truncate_text_to_tokens,
+)
+from app.core.tokenizer import _byte_decoder
+from app.core.vector_store import HashingEmbedder, InMemoryVectorStore, NumpyVectorStore, PersistentVectorStore, merge_scored
 from app.core.waitk_policy import WaitKPolicy
 
 
@@ -32,6 +56,57 @@ def main() -> None:
     ctx = cm.get_augmented_context("请总结", max_prompt_tokens=200)
     assert isinstance(ctx, list)
     assert len(ctx) > 0
+    totals = cm.token_totals()
+    assert totals["sink"] > 0 and totals["total"] == sum(v for key, v in totals.items() if key != "total")
+    assert totals["recent"] == sum(estimate_message_tokens(m) for m in cm.get_recent_context(99))
+    full = cm.get_augmented_context("请总结")
+    assert budget_messages(full, max_prompt_tokens=200, keep_last_n=6, max_single_message_tokens=900)[0] == ctx
+    assert budget_messages(msgs, max_prompt_tokens=100, keep_last_n=1, max_single_message_tokens=50, token_counts=[
+        message_token_counts(m) for m in msgs
+    ]) == (kept, total)
+
+    assert truncate_text_to_sentences("第一句。第二句很长很长！第三句", 9) == "第一句。第二句很长很长！"
+    scored_msgs = [
+        {"role": "system", "content": "sink"},
+        {"role": "system", "content": "闲聊 " * 50},
+        {"role": "system", "content": "[Memory:a] 重要 财报 数据。" * 20},
+        {"role": "user", "content": "now"},
+    ]
+    packed, ptotal = pack_messages(scored_msgs, [float("inf"), 0.05, 0.9, 0.0], max_prompt_tokens=120, keep_last_n=1)
+    assert [m["content"][:4] for m in packed] == ["sink", "[Mem", "now"] and ptotal <= 120
+    assert packed[1]["content"].endswith("。") and len(packed[1]["content"]) < len(scored_msgs[2]["content"])
+    cm5 = ContextManager(l1_max_turns=4, sink_turns=1, retrieval_k=2, packing="relevance")
+    for i in range(9):
+        cm5.add_user_input(f"第{i}轮 苹果 AAPL 财报 讨论 " * 4)
+    packed_ctx = cm5.get_augmented_context("AAPL 财报", max_prompt_tokens=600)
+    assert packed_ctx[0] == cm5.get_sink_context()[0] and packed_ctx[-1] == cm5.get_recent_context(1)[0]
+    assert sum(estimate_message_tokens(m) for m in packed_ctx) <= 600
+
+    with tempfile.TemporaryDirectory() as tok_dir:
+        merges = [(b"h", b"e"), (b"l", b"l"), (b"he", b"ll"), (b"hell", b"o"), (b" ", b"w")]
+        for ch in "苹果":
+            merges += [(ch.encode()[:1], ch.encode()[1:2]), (ch.encode()[:2], ch.encode()[2:])]
+        merges.append(("苹".encode(), "果".encode()))
+        ranks = {bytes([b]): b for b in range(256)}
+        for a, b in merges:
+            ranks[a + b] = len(ranks)
+        tik_path = os.path.join(tok_dir, "toy.tiktoken")
+        with open(tik_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{base64.b64encode(tok).decode()} {rank}\n" for tok, rank in ranks.items())
+        byte_map = {b: c for c, b in _byte_decoder().items()}
+        to_unicode = lambda tok: "".join(byte_map[b] for b in tok)
+        with open(os.path.join(tok_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({to_unicode(tok): rank for tok, rank in ranks.items()}, f)
+        with open(os.path.join(tok_dir, "merges.txt"), "w", encoding="utf-8") as f:
+            f.write("#version: 0.2\n" + "".join(f"{to_unicode(a)} {to_unicode(b)}\n" for a, b in merges))
+        for path in (tik_path, tok_dir):
+            tok = configure_tokenizer(path)
+            assert tok.name == "bpe" and tok.count("hello") == 1 and tok.count("hello world") == 6
+            assert estimate_tokens("苹果 hello") == 3 and tok.decode(tok.encode("苹果 hello")) == "苹果 hello"
+            assert truncate_text_to_tokens("hello hello hello", 2) == "hello " and tok.count_many(["", "he"]) == [0, 1]
+            assert message_token_counts_many(msgs) == [message_token_counts(m) for m in msgs]
+        assert configure_tokenizer(os.path.join(tok_dir, "missing.tiktoken")).name == "heuristic"
+        assert configure_tokenizer("").name == "heuristic" and estimate_tokens("hello world") == 2
 
     r = IncrementalRenderer(max_nodes=3, max_edges=3)
     for _ in range(8):
@@ -73,6 +148,23 @@ def main() -> None:
     assert p.observe(delta="fghij", now_ms=120) is True
     assert p.observe(delta="klmno", now_ms=300) is False
 
+    emb = HashingEmbedder()
+    texts = ["苹果 股票 AAPL 财报 2024 Q1", "", "hello hello world", "香蕉 水果 维生素"]
+    mat = emb.embed_many(texts)
+    for i, t in enumerate(texts):
+        assert mat[i].tolist() == [float(v) for v in np.asarray(emb.embed(t), dtype="float32")]
+
+    ref = InMemoryVectorStore()
+    fast = NumpyVectorStore()
+    for i, t in enumerate(["苹果 手机 iPhone 价格 8999", "苹果 股票 AAPL 财报 2024 Q1", "香蕉 水果 维生素", "AAPL 股价 走势"] * 10):
+        meta = {"source": "file", "filename": f"f{i % 3}.txt"}
+        ref.add(f"n{i}", t, meta=meta)
+        fast.add(f"n{i}", t, meta=meta)
+    for q, flt in [("苹果 财报", None), ("AAPL", {"filename": "f1.txt"}), ("维生素", None)]:
+        a = [c.text for c in ref.search(q, k=4, filters=flt, mmr_lambda=0.7, candidate_pool=12)]
+        b = [c.text for c in fast.search(q, k=4, filters=flt, mmr_lambda=0.7, candidate_pool=12)]
+        assert a == b, (q, a, b)
+
     db_path = os.path.join(os.path.dirname(__file__), "tmp_memory.sqlite")
     for suffix in ("", "-wal", "-shm"):
         try:
@@ -85,9 +177,191 @@ def main() -> None:
     ps.add("c3", "香蕉 水果 维生素", meta={"source": "file", "filename": "c.txt"})
     hits = ps.search("苹果 财报", k=2, mmr_lambda=0.7, candidate_pool=6)
     assert hits and hits[0].id in {"c1", "c2"}
+    scan = PersistentVectorStore(db_path=db_path, resident_cache=False)
+    assert [h.id for h in scan.search("苹果 财报", k=2, mmr_lambda=0.7, candidate_pool=6)] == [h.id for h in hits]
+    assert [h.id for h in ps.search("苹果", k=3, filters={"filename": "b.txt"})] == ["c2"]
+    ps.add("c3", "香蕉 水果 维生素 AAPL", meta={"source": "file", "filename": "c.txt"})
+    assert "c3" in [h.id for h in ps.search("AAPL", k=3)]
+    assert [h.id for h in PersistentVectorStore(db_path=db_path).search("维生素", k=1)] == ["c3"]
+    assert [h.id for h in ps.search("iPhone 价格", k=1, hybrid=True)] == ["c1"]
+    assert [h.id for h in scan.search("iPhone 价格", k=1, hybrid=True)] == ["c1"]
+    assert {h.id for h in ps.search("AAPL", k=3, hybrid=True)} == {"c2", "c3"}
+    assert [h.id for h in ps.search("AAPL", k=3, filters={"filename": "c.txt"}, hybrid=True)] == ["c3"]
+    hybrid_pool = ps.search_scored("维生素 AAPL", k=3, hybrid=True)
+    assert hybrid_pool[0][0] > 1.0 > hybrid_pool[-1][0]
+    assert [c.id for c in merge_scored([hybrid_pool], 3)] == [c.id for _, c in hybrid_pool[:3]]
+    c3_rowid = ps._rowids_for_ids(ps._connect(), ["c3"])["c3"]
+    assert ps._lexical_rowids("香蕉", 8, None) == [c3_rowid] and ps._lexical_rowids("生素 aap", 8, None) == [c3_rowid]
+    assert ps._lexical_rowids("吃维生素", 8, None) == [] and ps._lexical_rowids("维生素 Q1", 8, None) == []
+    before = ps.cache_stats()
+    first = [h.id for h in ps.search("苹果  财报", k=2, mmr_lambda=0.7, candidate_pool=6)]
+    assert [h.id for h in ps.search("苹果 财报", k=2, mmr_lambda=0.7, candidate_pool=6)] == first
+    assert ps.cache_stats()["hits"] == before["hits"] + 1
+    ps.search_scored("苹果 财报", k=2)[0][1].meta["filename"] = "mutated.txt"
+    assert ps.search_scored("苹果 财报", k=2)[0][1].meta["filename"] != "mutated.txt"
+    ps.add("c4", "苹果 财报 电话会", meta={"source": "file", "filename": "d.txt"})
+    assert "c4" in [h.id for h in ps.search("苹果 财报", k=2, mmr_lambda=0.7, candidate_pool=6)]
     cm2 = ContextManager(l1_max_turns=4, sink_turns=1, retrieval_k=2, store=ps, mmr_lambda=0.7, mmr_pool_mult=3)
     rr = cm2.retrieve("AAPL 财报", k=2)
     assert rr and any("AAPL" in (h.text or "") for h in rr)
+    assert [ch.id for _, ch in ps.score_ids("AAPL", ["c2", "missing"])] == ["c2"]
+    ps.search("维生素", k=1)
+    stats = ps.maintain(max_chunks=2, source_quotas={"file": 3})
+    assert stats["chunks"] == 2 and ps.count() == 2
+    kept = {h.id for h in ps.search("苹果 维生素 AAPL 财报 iPhone", k=4)}
+    assert "c3" in kept and kept <= {r[0] for r in ps._connect().execute("SELECT id FROM chunks")}
+    dd = PersistentVectorStore(db_path=db_path, dedup="merge")
+    assert dd.add_many([("c9", "香蕉 水果 维生素 AAPL", {"source": "file", "filename": "e.txt", "tag": "x"})]) == ["c3"]
+    assert dd.count() == 2 and dd.dedup_stats()["merged"] == 1
+    assert dd.search("香蕉 维生素", k=1)[0].meta.get("tag") == "x"
+    assert [h.id for h in dd.search("香蕉", k=1, filters={"filename": "e.txt"})] == ["c3"]
+
+    with tempfile.TemporaryDirectory() as ns_dir:
+        reg = MemoryNamespaces(base_dir=ns_dir, factory=lambda p: PersistentVectorStore(db_path=p), global_store=dd, max_open=1)
+        reg.view(write="tenant:a", read=["tenant:a"]).add_many([("a1", "租户A 私有 香蕉 报告", {})])
+        reg.view(write="tenant:b", read=["tenant:b"]).add_many([("b1", "租户B 私有 香蕉 报告", {})])
+        assert reg.open_namespaces() == ["tenant:b"]
+        ids = [h.id for h in reg.view(write="tenant:a", read=["tenant:a", "global"]).search("香蕉 报告", k=3)]
+        assert "a1" in ids and "c3" in ids and "b1" not in ids
+        reg.close()
+        assert reg.sweep(["tenant:a"], max_idle_s=3600) == []
+        assert reg.sweep(["tenant:a"], max_idle_s=0) == []
+        stale = time.time() - 7200
+        for name in os.listdir(ns_dir):
+            os.utime(os.path.join(ns_dir, name), (stale, stale))
+        assert reg.sweep(["tenant:a"], max_idle_s=3600) == [os.path.basename(reg.path_for("tenant:b"))[: -len(".sqlite")]]
+        assert os.listdir(ns_dir) and all(n.startswith("tenant_a") for n in os.listdir(ns_dir))
+
+    with tempfile.TemporaryDirectory() as legacy_dir:
+        legacy_db = os.path.join(legacy_dir, "legacy.sqlite")
+        with sqlite3.connect(legacy_db) as legacy:
+            legacy.execute("CREATE TABLE legacy (a)")
+        upgraded = PersistentVectorStore(db_path=legacy_db)
+        assert upgraded._connect().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        upgraded.close()
+
+    with tempfile.TemporaryDirectory() as ann_dir:
+        rnd = np.random.default_rng(3)
+        words = np.array([f"w{i}" for i in range(2000)])
+        zipf = 1.0 / np.arange(1, words.size + 1) ** 1.07
+        docs = [(f"a{i}", " ".join(rnd.choice(words, size=24, p=zipf / zipf.sum())), {}) for i in range(3000)]
+        exact_store = NumpyVectorStore(query_cache_size=0)
+        exact_store.add_many(docs)
+        annd = PersistentVectorStore(db_path=os.path.join(ann_dir, "ann.sqlite"), ann_min_chunks=len(docs), query_cache_size=0)
+        annd.add_many(docs)
+        assert annd.build_ann_index() is not None
+        queries = [" ".join(rnd.choice(docs[int(rnd.integers(len(docs)))][1].split(), size=6, replace=False)) for _ in range(50)]
+        recall = np.mean([len({h.id for h in annd.search(q, k=8)} & {h.id for h in exact_store.search(q, k=8)}) / 8 for q in queries])
+        assert recall >= 0.95, recall
+        annd.close()
+
+    with tempfile.TemporaryDirectory() as snap_dir:
+        snap_db = os.path.join(snap_dir, "snap.sqlite")
+        sv = PersistentVectorStore(db_path=snap_db, snapshot=True, emb_format="i8")
+        sv.add_many([(f"s{i}", f"快照 {i} 苹果 财报 AAPL t{i % 5}", {"source": "file"}) for i in range(40)])
+        expect = [h.id for h in sv.search("苹果 t3", k=3)]
+        q3 = HashingEmbedder().embed("苹果 t3")
+        exact = sv.search_scored("苹果 t3", k=3)
+        assert all(abs(sc - float(np.dot(q3, HashingEmbedder().embed(ch.text)))) < 1e-5 for sc, ch in exact)
+        sv.close()
+        sv = PersistentVectorStore(db_path=snap_db, snapshot=True, emb_format="i8")
+        assert [h.id for h in sv.search("苹果 t3", k=3)] == expect and sv.verify_snapshot()["ok"]
+        sv.add("s40", "快照 之后 新增 香蕉", {"source": "file"})
+        assert sv.maintain(max_chunks=30)["snapshot"] == 1 and sv.maintain()["snapshot"] == 0
+        generation = sv._db_generation(sv._connect())
+        sv.add("s39", "快照 覆盖 写入 芒果", {"source": "file"})
+        assert sv._db_generation(sv._connect()) == generation
+        sv._pool.close()
+        sv = PersistentVectorStore(db_path=snap_db, snapshot=True, emb_format="i8")
+        assert len(sv._pos_by_id) == sv.count() == 30 and sv.search("香蕉", k=1)[0].id == "s40"
+        assert sv.search("芒果", k=1)[0].id == "s39" and sv.verify_snapshot()["ok"]
+        sv.close()
+
+    with tempfile.TemporaryDirectory() as ent_dir:
+        ent_db = os.path.join(ent_dir, "ent.sqlite")
+        es = PersistentVectorStore(db_path=ent_db)
+        es.add("e1", "苹果 股票 AAPL 财报", meta={"source": "chat", "entities": ["AAPL"]})
+        es.add("e2", "NVDA 数据中心 订单", meta={"source": "chat", "entities": ["NVDA", "AAPL"]})
+        es.add("e3", "香蕉 水果 维生素", meta={"source": "chat"})
+        assert es.entity_chunk_ids(["AAPL", "TSLA"], 2) == {"AAPL": ["e2", "e1"], "TSLA": []}
+        assert es.entity_cache_stats()["size"] == 2
+        stale = es._entity_cache.generation
+        es._entity_cache.discard(["TSLA"])
+        es._entity_cache.put("TSLA", stale, ["e9"])
+        assert es.entity_chunk_ids(["TSLA"], 2) == {"TSLA": []}
+        cm4 = ContextManager(l1_max_turns=4, sink_turns=0, retrieval_k=2, store=es)
+        calls = []
+        scored = es.search_scored
+        es.search_scored = lambda *a, **kw: calls.append(a) or scored(*a, **kw)
+        assert "e2" in [h.id for h in cm4.retrieve("AAPL 订单", k=2)] and len(calls) == 1
+        del es.search_scored
+        plain = NumpyVectorStore()
+        plain.add("p1", "AAPL 财报 电话会", {"entities": ["AAPL"]})
+        seen_kw = []
+        search = lambda *a, **kw: seen_kw.append(kw) or plain.search(*a, **kw)
+        cm5 = ContextManager(
+            l1_max_turns=4, sink_turns=0, retrieval_k=2, mmr_lambda=0.6, mmr_pool_mult=3, store=SimpleNamespace(search=search)
+        )
+        assert cm5.retrieve_scored("AAPL 财报", k=2) == [(1.0, plain.search("AAPL 财报", 2)[0])]
+        assert seen_kw == [{"mmr_lambda": 0.6, "candidate_pool": 6}]
+        es.add("e2", "NVDA 数据中心 订单", meta={"source": "chat", "entities": ["NVDA"]})
+        assert es.entity_chunk_ids(["AAPL", "NVDA"], 2) == {"AAPL": ["e1"], "NVDA": ["e2"]}
+        es.maintain(max_chunks=1)
+        assert sum(len(v) for v in es.entity_chunk_ids(["AAPL", "NVDA"], 2).values()) <= 1
+        with es._connect() as conn:
+            conn.execute("DELETE FROM chunk_entities")
+            conn.execute("DELETE FROM store_meta WHERE key='chunk_entities'")
+        es.close()
+        es = PersistentVectorStore(db_path=ent_db)
+        assert es.entity_chunk_ids(["AAPL", "NVDA"], 2) == {
+            e: [ch.id for ch in es.iter_chunks() if e in ch.meta.get("entities", [])] for e in ["AAPL", "NVDA"]
+        }
+        es.close()
+
+    async def _write_behind() -> None:
+        writer = MemoryWriter(max_queue=4, max_batch=8)
+        writer.start()
+        wb = NumpyVectorStore()
+        cm3 = ContextManager(l1_max_turns=2, sink_turns=0, retrieval_k=2, store=wb, writer=writer, session="s1")
+        for t in ["苹果 AAPL 财报 发布 ", "香蕉 维生素 水果 ", "英伟达 NVDA 显卡 ", "天气 晴朗 ", "会议 纪要 "]:
+            cm3.add_user_input(t * 20)
+        await writer.wait_session("s1")
+        assert len(list(wb.iter_chunks())) >= 2 and writer.stats()["batches"] >= 1
+        assert any("AAPL" in h.text for h in cm3.retrieve("AAPL 财报", k=2))
+        assert await writer.submit(wb, [("w1", "写后 队列 测试", {})]) == ["w1"]
+        await writer.close()
+        assert not writer.running
+        assert (await writer.submit(wb, [("w2", "写后 内联 回退", {})])) == ["w2"] and writer.stats()["inline"] == 1
+        slow = MemoryWriter(max_queue=2, max_batch=8, max_inline=1)
+        slow.start()
+        gate = threading.Event()
+        blocked = NumpyVectorStore()
+        add_many = blocked.add_many
+        entered: list = []
+        blocked.add_many = lambda items: entered.append(items) or (gate.wait(5) and add_many(items))
+        first = slow.submit(blocked, [("q1", "排队 一", {}), ("q2", "排队 二", {})])
+        spills = [slow.submit(blocked, [(f"q{i}", f"溢出 {i}", {})], session="s2") for i in range(3, 6)]
+        await asyncio.sleep(0.05)
+        assert slow.stats()["queued_items"] == 2 and len(entered) == 2 and not any(f.done() for f in spills)
+        gate.set()
+        await slow.wait_session("s2")
+        assert await first == ["q1", "q2"] and [await f for f in spills] == [["q3"], ["q4"], ["q5"]]
+        assert slow.stats()["inline"] == 3
+        await slow.close()
+        broken = NumpyVectorStore()
+        broken.add_many = lambda items: 1 / 0
+        lost: list = []
+        handler = logging.Handler()
+        handler.emit = lost.append
+        logging.getLogger("streamvis").addHandler(handler)
+        cm4 = ContextManager(l1_max_turns=1, sink_turns=0, retrieval_k=2, store=broken, writer=writer, session="s3")
+        for t in ["丢失 写入 ", "触发 淘汰 ", "英伟达 NVDA ", "天气 晴朗 ", "会议 纪要 "]:
+            cm4.add_user_input(t * 20)
+        await writer.wait_session("s3")
+        logging.getLogger("streamvis").removeHandler(handler)
+        assert lost and lost[0].exc_info[0] is ZeroDivisionError
+
+    asyncio.run(_write_behind())
 
     print("algo_smoke: ok")
 
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.context_manager import ContextManager
+from app.core.segmenter import extract_entities
+from app.core.vector_store import MemoryChunk, NumpyVectorStore, PersistentVectorStore
+
+
+_TICKERS = ["AAPL", "NVDA", "TSLA", "MSFT", "GOOG", "AMZN", "META", "TSMC", "BABA", "JD"]
+_ZH = ["营收", "净利润", "毛利率", "同比增长", "环比下降", "季度", "市场份额", "现金流", "研发投入", "指引"]
+_EN = ["revenue", "margin", "guidance", "capex", "churn", "buyback"]
+
+
+def _turn(rnd: random.Random, i: int) -> str:
+    words = [rnd.choice(_TICKERS), rnd.choice(_TICKERS)] + rnd.sample(_ZH, 5) + [rnd.choice(_EN)]
+    rnd.shuffle(words)
+    return f"第{i}轮 " + " ".join(words) + "。" + " ".join(rnd.sample(_ZH, 4)) * 3
+
+
+def _legacy_retrieve(cm: ContextManager, store: Any, query: str, k: int) -> List[MemoryChunk]:
+    hits: List[MemoryChunk] = []
+    pool = max(k * cm._mmr_pool_mult, k)
+    seen = set()
+    for ids in store.entity_chunk_ids(extract_entities(query), k).values():
+        for cid in ids:
+            for ch in store.search(query, k=pool, mmr_lambda=cm._mmr_lambda, candidate_pool=pool):
+                if ch.id == cid and ch.id not in seen:
+                    hits.append(ch)
+                    seen.add(ch.id)
+    for ch in store.search(query, k=k, mmr_lambda=cm._mmr_lambda, candidate_pool=pool):
+        if ch not in hits:
+            hits.append(ch)
+    return hits[:k]
+
+
+def _p50_ms(samples: List[float]) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000.0, 50)) if samples else 0.0
+
+
+def _bench(label: str, store: Any, turns: int, queries: int, k: int) -> bool:
+    rnd = random.Random(11)
+    cm = ContextManager(l1_max_turns=4, sink_turns=0, retrieval_k=k, store=store)
+    for i in range(turns):
+        cm.add_user_input(_turn(rnd, i))
+    qs = [f"{rnd.choice(_TICKERS)} {rnd.choice(_TICKERS)} {rnd.choice(_ZH)} {rnd.choice(_EN)}" for _ in range(queries)]
+
+    legacy_t, new_t = [], []
+    covered = linked = 0
+    for q in qs:
+        t0 = time.perf_counter()
+        old = _legacy_retrieve(cm, store, q, k)
+        legacy_t.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        new = cm.retrieve(q, k=k)
+        new_t.append(time.perf_counter() - t0)
+        entity_ids = {cid for ids in store.entity_chunk_ids(extract_entities(q), k).values() for cid in ids}
+        old_linked = [ch.id for ch in old if ch.id in entity_ids]
+        new_ids = {ch.id for ch in new}
+        linked += len(old_linked)
+        covered += sum(1 for cid in old_linked if cid in new_ids)
+
+    legacy, fresh = _p50_ms(legacy_t), _p50_ms(new_t)
+    coverage = covered / linked if linked else 1.0
+    print(
+        f"{label:<8} turns={turns:<5d} legacy p50 {legacy:8.2f}ms  single-pass p50 {fresh:7.2f}ms  "
+        f"({legacy / max(fresh, 1e-9):5.1f}x)  entity-hit coverage {coverage:.3f}"
+    )
+    return fresh <= legacy and coverage >= 0.9
+
+
+def main() -> None:
+    turns = int(os.getenv("BENCH_TURNS", "2000"))
+    queries = int(os.getenv("BENCH_QUERIES", "50"))
+    k = int(os.getenv("BENCH_K", "4"))
+    ok = _bench("numpy", NumpyVectorStore(query_cache_size=0), turns, queries, k)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PersistentVectorStore(db_path=os.path.join(tmp, "bench.sqlite"), query_cache_size=0)
+        ok = _bench("sqlite", store, turns, queries, k) and ok
+        store.close()
+    if not ok:
+        print("[FAIL] single-pass retrieve regressed against the legacy loop")
+        sys.exit(1)
+    print("[OK] single-pass retrieve")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.token_budget import estimate_tokens, estimate_tokens_cached
+
+
+_ZH = "营收净利润毛利率同比环比增长下降季度年度市场份额用户规模现金流资产负债成本费用研发投入芯片手机电池汽车能源"
+_EN = ["revenue", "margin", "guidance", "capex", "AAPL", "NVDA", "def", "return", "import", "numpy", "{", "}", "(", ")"]
+
+
+def _legacy_estimate_tokens(text: str) -> int:
+    s = text or ""
+    if not s:
+        return 0
+    ascii_count = 0
+    non_ascii_count = 0
+    for ch in s:
+        if ord(ch) < 128:
+            ascii_count += 1
+        else:
+            non_ascii_count += 1
+    return max(1, int(ascii_count / 4.0 + non_ascii_count / 1.5))
+
+
+def _corpus(rnd: random.Random, kind: str, chars: int, count: int) -> List[str]:
+    out = []
+    for _ in range(count):
+        parts: List[str] = []
+        size = 0
+        while size < chars:
+            if kind == "ascii" or (kind == "mixed" and rnd.random() < 0.5):
+                p = rnd.choice(_EN) + " "
+            else:
+                p = "".join(rnd.choice(_ZH) for _ in range(rnd.randint(2, 6))) + "，"
+            parts.append(p)
+            size += len(p)
+        out.append("".join(parts)[:chars])
+    return out
+
+
+def _time_us(fn: Callable[[str], int], texts: List[str], repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for t in texts:
+            fn(t)
+    return (time.perf_counter() - t0) / (repeat * len(texts)) * 1e6
+
+
+def main() -> None:
+    count = int(os.getenv("BENCH_COUNT", "200"))
+    repeat = int(os.getenv("BENCH_REPEAT", "5"))
+    sizes = [int(s) for s in os.getenv("BENCH_SIZES", "64,900,8000").split(",") if s.strip()]
+    rnd = random.Random(5)
+    ok = True
+    for kind in ["ascii", "cjk", "mixed"]:
+        for chars in sizes:
+            texts = _corpus(rnd, kind, chars, count)
+            texts += ["", "a", "中", "é" * 7, "\U0001f600 emoji"]
+            mismatch = [t for t in texts if _legacy_estimate_tokens(t) != estimate_tokens(t)]
+            ok = ok and not mismatch
+            timings: Dict[str, float] = {
+                "legacy": _time_us(_legacy_estimate_tokens, texts, repeat),
+                "fast": _time_us(estimate_tokens, texts, repeat),
+            }
+            estimate_tokens_cached.cache_clear()
+            timings["cached"] = _time_us(estimate_tokens_cached, texts, repeat)
+            print(
+                f"{kind:<6} chars={chars:<6d} legacy {timings['legacy']:9.2f}us  fast {timings['fast']:7.2f}us "
+                f"({timings['legacy'] / max(timings['fast'], 1e-9):6.1f}x)  cached {timings['cached']:7.2f}us  "
+                f"mismatches {len(mismatch)}"
+            )
+    if not ok:
+        print("[FAIL] estimate_tokens differs from the legacy implementation")
+        sys.exit(1)
+    print("[OK] estimate_tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.file_indexer import index_text
+from app.core.vector_store import PersistentVectorStore
+
+
+_WORDS_ZH = list("营收净利润毛利率同比环比增长下降季度年度市场份额用户规模现金流资产负债成本费用研发投入")
+_WORDS_EN = ["revenue", "margin", "AAPL", "NVDA", "quarter", "guidance", "EBITDA", "capex", "growth", "churn"]
+
+
+def _synthetic_document(pages: int, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    paras = []
+    for _ in range(pages * 4):
+        parts = []
+        for _ in range(rnd.randint(20, 60)):
+            if rnd.random() < 0.7:
+                parts.append("".join(rnd.choice(_WORDS_ZH) for _ in range(rnd.randint(2, 6))))
+            else:
+                parts.append(rnd.choice(_WORDS_EN))
+        paras.append(" ".join(parts) + "。")
+    return "\n\n".join(paras)
+
+
+class _Recorder:
+    def __init__(self) -> None:
+        self.items = []
+
+    def add_many(self, items) -> None:
+        self.items.extend(items)
+
+
+def _report(label: str, count: int, dt: float) -> None:
+    print(f"{label:<22} {count:6d} chunks in {dt:7.2f}s  -> {count / max(dt, 1e-9):9.1f} chunks/s")
+
+
+def main() -> None:
+    pages = int(os.getenv("BENCH_PAGES", "300"))
+    text = _synthetic_document(pages)
+    print(f"synthetic document: {pages} pages, {len(text)} chars")
+
+    rec = _Recorder()
+    t0 = time.perf_counter()
+    index_text(store=rec, text=text, meta={"source": "file", "filename": "bench.txt", "kind": "file"})
+    _report("segmentation only", len(rec.items), time.perf_counter() - t0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        a = PersistentVectorStore(db_path=os.path.join(tmp, "per_chunk.sqlite"))
+        t0 = time.perf_counter()
+        for cid, chunk, meta in rec.items:
+            a.add(cid, chunk, meta=meta)
+        _report("store add() per chunk", len(rec.items), time.perf_counter() - t0)
+        a.close()
+
+        b = PersistentVectorStore(db_path=os.path.join(tmp, "bulk.sqlite"))
+        t0 = time.perf_counter()
+        b.add_many(rec.items)
+        _report("store add_many() bulk", len(rec.items), time.perf_counter() - t0)
+        b.close()
+
+        c = PersistentVectorStore(db_path=os.path.join(tmp, "index_text.sqlite"))
+        t0 = time.perf_counter()
+        count, _ = index_text(store=c, text=text, meta={"source": "file", "filename": "bench.txt", "kind": "file"})
+        _report("index_text end-to-end", count, time.perf_counter() - t0)
+        c.close()
+
+
+if __name__ == "__main__":
+    main()
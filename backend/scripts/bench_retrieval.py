@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.vector_store import HashingEmbedder, InMemoryVectorStore, NumpyVectorStore, PersistentVectorStore
+
+
+_ZH_CHARS = "营收净利润毛利率同比环比增长下降季度年度市场份额用户规模现金流资产负债成本费用研发投入芯片手机电池汽车能源银行保险医药消费零售物流政策利率汇率通胀就业出口进口"
+_EN_WORDS = [
+    "revenue", "margin", "quarter", "guidance", "EBITDA", "capex", "growth", "churn", "AAPL", "NVDA",
+    "TSLA", "MSFT", "GOOG", "AMZN", "META", "TSMC", "yield", "inflation", "rates", "buyback",
+    "dividend", "forecast", "supply", "demand", "inventory", "pricing", "cloud", "GPU", "battery", "EV",
+]
+
+
+def _vocab(rng: np.random.Generator, size: int) -> List[str]:
+    words = list(_EN_WORDS) + [f"T{i:04d}" for i in range(size // 8)]
+    chars = np.array(list(_ZH_CHARS))
+    while len(words) < size:
+        words.append("".join(rng.choice(chars, size=int(rng.integers(2, 5)))))
+    return words[:size]
+
+
+def _corpus(n: int, seed: int) -> Tuple[List[str], List[str]]:
+    rng = np.random.default_rng(seed)
+    vocab = np.array(_vocab(rng, 4096), dtype=object)
+    p = 1.0 / np.arange(1, vocab.shape[0] + 1) ** 1.07
+    p /= p.sum()
+    lengths = rng.integers(12, 48, size=n)
+    toks = vocab[rng.choice(vocab.shape[0], size=int(lengths.sum()), p=p)]
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    texts = [" ".join(toks[bounds[i] : bounds[i + 1]]) for i in range(n)]
+    return [f"d{i}" for i in range(n)], texts
+
+
+def _queries(texts: List[str], count: int, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed + 1)
+    out = []
+    for i in rng.choice(len(texts), size=count, replace=len(texts) < count):
+        words = texts[int(i)].split()
+        take = min(len(words), int(rng.integers(3, 7)))
+        out.append(" ".join(rng.choice(words, size=take, replace=False)))
+    return out
+
+
+def _normalized(embedder: HashingEmbedder, texts: List[str]) -> np.ndarray:
+    mat = np.asarray(embedder.embed_many(texts), dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return mat / norms
+
+
+def _exact_topk(embedder: HashingEmbedder, texts: List[str], queries: List[str], k: int, *, block: int = 50000) -> np.ndarray:
+    q = _normalized(embedder, queries)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    for start in range(0, len(texts), block):
+        scores = q @ _normalized(embedder, texts[start : start + block]).T
+        merged = np.concatenate((best_scores, scores), axis=1)
+        keep = min(k, merged.shape[1])
+        best_scores = -np.sort(-merged, axis=1)[:, :keep]
+    return best_scores
+
+
+def _recall(embedder: HashingEmbedder, query: str, hits: List[Any], truth: np.ndarray, k: int) -> Optional[float]:
+    positive = truth[truth > 0.0]
+    if positive.size == 0:
+        return None
+    want = min(k, positive.size)
+    if not hits:
+        return 0.0
+    q = _normalized(embedder, [query])[0]
+    got = _normalized(embedder, [h.text for h in hits[:k]]) @ q
+    return min(int(np.count_nonzero(got >= positive[want - 1] - 1e-5)), want) / want
+
+
+def _resident_bytes(store: Any) -> Optional[int]:
+    matrix = getattr(store, "_matrix", None)
+    return None if matrix is None else int(matrix.nbytes)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    arr = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def _timed(fn: Callable[[], Any]) -> Tuple[float, Any]:
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return ""
+    return out.stdout.strip()
+
+
+def _variants(tmp: str) -> List[Tuple[str, Callable[[int], Any], Dict[str, Any], int]]:
+    inmemory_max = int(os.getenv("BENCH_INMEMORY_MAX", "10000"))
+    scan_max = int(os.getenv("BENCH_SCAN_MAX", "10000"))
+
+    def sqlite(name: str, **kw: Any) -> Callable[[int], Any]:
+        return lambda n: PersistentVectorStore(
+            db_path=os.path.join(tmp, f"{name}_{n}.sqlite"), query_cache_size=0, **{"ann_min_chunks": 0, **kw}
+        )
+
+    return [
+        ("inmemory", lambda n: InMemoryVectorStore(), {}, inmemory_max),
+        ("numpy", lambda n: NumpyVectorStore(query_cache_size=0), {}, 0),
+        ("sqlite_f32", sqlite("f32"), {}, 0),
+        ("sqlite_i8", sqlite("i8", emb_format="i8"), {}, 0),
+        ("sqlite_ann", sqlite("ann", ann_min_chunks=1), {}, 0),
+        ("sqlite_hybrid", sqlite("hybrid"), {"hybrid": True}, 0),
+        ("sqlite_scan", sqlite("scan", resident_cache=False), {}, scan_max),
+    ]
+
+
+def _bench_store(
+    name: str,
+    factory: Callable[[int], Any],
+    search_kw: Dict[str, Any],
+    ids: List[str],
+    texts: List[str],
+    queries: List[str],
+    truth: np.ndarray,
+    *,
+    k: int,
+    mmr_lambda: float,
+    pool_mult: int,
+    embedder: HashingEmbedder,
+    trace_memory: bool,
+) -> Dict[str, Any]:
+    n = len(ids)
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    store = factory(n)
+    batch = 5000
+    build_s = 0.0
+    for start in range(0, n, batch):
+        items = [(ids[i], texts[i], {"source": "bench"}) for i in range(start, min(n, start + batch))]
+        dt, _ = _timed(lambda: store.add_many(items))
+        build_s += dt
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    resident = _resident_bytes(store)
+    if name == "sqlite_ann":
+        store.build_ann_index()
+
+    add_lat = []
+    for i in range(min(200, max(1, n // 50))):
+        dt, _ = _timed(lambda: store.add(f"extra{i}", f"{texts[i % n]} extra{i}", {"source": "extra"}))
+        add_lat.append(dt)
+
+    search_lat, mmr_lat, recalls = [], [], []
+    for qi, query in enumerate(queries):
+        dt, hits = _timed(lambda: store.search(query, k=k, **search_kw))
+        search_lat.append(dt)
+        r = _recall(embedder, query, hits, truth[qi], k)
+        if r is not None:
+            recalls.append(r)
+        dt, _ = _timed(lambda: store.search(query, k=k, mmr_lambda=mmr_lambda, candidate_pool=k * pool_mult, **search_kw))
+        mmr_lat.append(dt)
+
+    out: Dict[str, Any] = {
+        "store": name,
+        "n": n,
+        "build_s": round(build_s, 3),
+        "build_chunks_per_s": round(n / max(build_s, 1e-9), 1),
+        "resident_bytes": resident,
+        "traced_peak_bytes": int(peak) if trace_memory else None,
+        "add": _percentiles(add_lat),
+        "search": _percentiles(search_lat),
+        "mmr": _percentiles(mmr_lat),
+        f"recall_at_{k}": round(float(np.mean(recalls)), 4) if recalls else None,
+    }
+    if isinstance(store, PersistentVectorStore):
+        db_path = store._db_path
+        store.close()
+        out["db_bytes"] = sum(
+            os.path.getsize(db_path + suffix) for suffix in ("", "-wal") if os.path.exists(db_path + suffix)
+        )
+    return out
+
+
+def _print_row(r: Dict[str, Any], k: int) -> None:
+    recall = r.get(f"recall_at_{k}")
+    resident = "-" if r["resident_bytes"] is None else f"{r['resident_bytes'] / 1048576:.1f}MB"
+    traced = "-" if r["traced_peak_bytes"] is None else f"{r['traced_peak_bytes'] / 1048576:.1f}MB"
+    print(
+        f"{r['store']:<14} n={r['n']:<8d} build {r['build_chunks_per_s']:>9.1f}/s  "
+        f"resident {resident:>8}  "
+        f"traced peak {traced:>8}  "
+        f"search p50/p95/p99 {r['search']['p50_ms']:7.2f}/{r['search']['p95_ms']:7.2f}/{r['search']['p99_ms']:7.2f}ms  "
+        f"mmr p50 {r['mmr']['p50_ms']:7.2f}ms  add p50 {r['add']['p50_ms']:6.2f}ms  "
+        f"recall@{k} {'-' if recall is None else f'{recall:.3f}'}"
+    )
+
+
+def main() -> None:
+    sizes = [int(s) for s in os.getenv("BENCH_SIZES", "1000,10000,100000").split(",") if s.strip()]
+    n_queries = int(os.getenv("BENCH_QUERIES", "200"))
+    k = int(os.getenv("BENCH_K", "8"))
+    mmr_lambda = float(os.getenv("BENCH_MMR_LAMBDA", "0.65"))
+    pool_mult = int(os.getenv("BENCH_POOL_MULT", "4"))
+    seed = int(os.getenv("BENCH_SEED", "7"))
+    wanted = {s.strip() for s in os.getenv("BENCH_STORES", "").split(",") if s.strip()}
+    out_path = os.getenv("BENCH_OUT", "")
+    ann_min_recall = float(os.getenv("BENCH_ANN_MIN_RECALL", "0.95"))
+    trace_memory = os.getenv("BENCH_MEMORY", "0").strip() in {"1", "true", "True"}
+
+    embedder = HashingEmbedder()
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            ids, texts = _corpus(n, seed)
+            queries = _queries(texts, n_queries, seed)
+            dt, truth = _timed(lambda: _exact_topk(embedder, texts, queries, k))
+            print(f"corpus n={n}: {sum(len(t) for t in texts)} chars, {len(queries)} queries, exact top-{k} in {dt:.2f}s")
+            for name, factory, search_kw, max_n in _variants(tmp):
+                if wanted and name not in wanted:
+                    continue
+                if max_n and n > max_n:
+                    continue
+                r = _bench_store(
+                    name,
+                    factory,
+                    search_kw,
+                    ids,
+                    texts,
+                    queries,
+                    truth,
+                    k=k,
+                    mmr_lambda=mmr_lambda,
+                    pool_mult=pool_mult,
+                    embedder=embedder,
+                    trace_memory=trace_memory,
+                )
+                results.append(r)
+                _print_row(r, k)
+
+    report = {
+        "meta": {
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "timestamp": int(time.time()),
+            "sizes": sizes,
+            "queries": n_queries,
+            "k": k,
+            "mmr_lambda": mmr_lambda,
+            "pool_mult": pool_mult,
+            "seed": seed,
+        },
+        "results": results,
+    }
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"wrote {out_path}")
+    else:
+        print(json.dumps(report, ensure_ascii=False))
+    low = [r for r in results if r["store"] == "sqlite_ann" and (r[f"recall_at_{k}"] or 0.0) < ann_min_recall]
+    if low:
+        print(f"[FAIL] sqlite_ann recall@{k} below {ann_min_recall} at n={[r['n'] for r in low]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
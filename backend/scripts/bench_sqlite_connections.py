@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.vector_store import PersistentVectorStore
+
+
+def _fresh_connection(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    return conn
+
+
+def _per_call_us(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main() -> None:
+    n = int(os.getenv("BENCH_CALLS", "2000"))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.sqlite")
+        store = PersistentVectorStore(db_path=db_path, resident_cache=False)
+        for i in range(200):
+            store.add(f"c{i}", f"chunk {i} 苹果 财报 AAPL", meta={"source": "bench"})
+
+        sql = "SELECT id,text FROM chunks WHERE id=?"
+
+        def per_call_connect() -> None:
+            conn = _fresh_connection(db_path)
+            try:
+                conn.execute(sql, ("c42",)).fetchone()
+            finally:
+                conn.close()
+
+        def pooled() -> None:
+            store._connect().execute(sql, ("c42",)).fetchone()
+
+        before = _per_call_us(per_call_connect, n)
+        after = _per_call_us(pooled, n)
+        print(f"point lookup  per-call connect: {before:8.1f} us/call")
+        print(f"point lookup  pooled:           {after:8.1f} us/call  ({before / max(after, 1e-9):.1f}x)")
+
+        def add_per_call_connect() -> None:
+            conn = _fresh_connection(db_path)
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chunks(id,text,emb,meta,created_at) VALUES (?,?,?,?,?)",
+                    ("bench", "x", b"", "{}", int(time.time())),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+        def add_pooled() -> None:
+            conn = store._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chunks(id,text,emb,meta,created_at) VALUES (?,?,?,?,?)",
+                    ("bench", "x", b"", "{}", int(time.time())),
+                )
+
+        m = max(1, n // 4)
+        before = _per_call_us(add_per_call_connect, m)
+        after = _per_call_us(add_pooled, m)
+        print(f"single insert per-call connect: {before:8.1f} us/call")
+        print(f"single insert pooled:           {after:8.1f} us/call  ({before / max(after, 1e-9):.1f}x)")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
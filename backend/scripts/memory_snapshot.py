@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.config import get_settings
+from app.core.vector_store import PersistentVectorStore
+
+
+def _default_db() -> str:
+    path = get_settings().memory_db_path
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.dirname(__file__)), path)
+
+
+def _open(db_path: str, *, snapshot: bool, resident_cache: bool = True) -> PersistentVectorStore:
+    settings = get_settings()
+    return PersistentVectorStore(
+        db_path=db_path,
+        resident_cache=resident_cache,
+        emb_format=settings.memory_emb_format,
+        ann_min_chunks=0,
+        fts=False,
+        snapshot=snapshot,
+    )
+
+
+def build(db_path: str, *, rebuild: bool) -> int:
+    t0 = time.perf_counter()
+    store = _open(db_path, snapshot=not rebuild)
+    loaded = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    path = store.save_snapshot()
+    saved = time.perf_counter() - t0
+    count = store.count()
+    store.close()
+    if path is None:
+        print(f"[FAIL] snapshot not written for {db_path}")
+        return 1
+    print(f"[OK] {count} chunks -> {path}  (load {loaded:.2f}s, write {saved:.2f}s)")
+    return 0
+
+
+def verify(db_path: str, *, sample: int) -> int:
+    store = _open(db_path, snapshot=False, resident_cache=False)
+    t0 = time.perf_counter()
+    report = store.verify_snapshot(sample=sample)
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    store.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report.get("ok") else 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or verify the memory vector snapshot.")
+    parser.add_argument("command", choices=["build", "verify"])
+    parser.add_argument("--db", default="", help="SQLite memory DB (default: STREAMVIS_MEMORY_DB_PATH)")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing snapshot and rescan the DB")
+    parser.add_argument("--sample", type=int, default=0, help="verify only N random rows (0 = all)")
+    args = parser.parse_args()
+    db_path = os.path.abspath(args.db or _default_db())
+    if not os.path.exists(db_path):
+        print(f"[FAIL] no such DB: {db_path}")
+        sys.exit(1)
+    if args.command == "build":
+        sys.exit(build(db_path, rebuild=args.rebuild))
+    sys.exit(verify(db_path, sample=args.sample))
+
+
+if __name__ == "__main__":
+    main()
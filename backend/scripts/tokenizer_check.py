@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app.core.tokenizer import HeuristicTokenizer, load_tokenizer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare heuristic token estimates with a local BPE vocabulary.")
+    parser.add_argument("--vocab", required=True, help="tiktoken ranks file, vocab.json (with merges.txt) or a directory")
+    parser.add_argument("files", nargs="*", help="text files to count (default: stdin)")
+    args = parser.parse_args()
+
+    tok = load_tokenizer(args.vocab)
+    if tok is None:
+        print(f"[FAIL] could not load tokenizer from {args.vocab}")
+        sys.exit(1)
+    texts = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            texts.append((path, f.read()))
+    if not texts:
+        texts.append(("<stdin>", sys.stdin.read()))
+
+    heuristic = HeuristicTokenizer()
+    rows = []
+    for name, text in texts:
+        t0 = time.perf_counter()
+        exact = tok.count(text)
+        elapsed = time.perf_counter() - t0
+        approx = heuristic.count(text)
+        rows.append(
+            {
+                "file": name,
+                "chars": len(text),
+                "bpe": exact,
+                "heuristic": approx,
+                "error_pct": round((approx - exact) / exact * 100.0, 1) if exact else 0.0,
+                "bpe_ms": round(elapsed * 1000.0, 2),
+            }
+        )
+    hits, misses, size = tok.cache_info()
+    print(json.dumps({"vocab": len(tok), "cache": {"hits": hits, "misses": misses, "size": size}, "files": rows}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()